@@ -1,2 +1,11 @@
-from .photo_vector_search import PhotoVectorStore
-from .cli import cli
\ No newline at end of file
+def __getattr__(name):
+    # Imported on first use: spawned preprocessing workers import this package to unpickle
+    # preprocess.preprocess_photo and must not load torch, chromadb and CLIP
+    if name == "PhotoVectorStore":
+        from .photo_vector_search import PhotoVectorStore as value
+    elif name == "cli":
+        from .cli import cli as value
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -0,0 +1,69 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba is an optional speed-up
+    numba = None
+
+# Below this many rows a fused single-pass kernel beats BLAS's thread start-up cost
+NUMBA_MAX_ROWS = 50_000
+# Rows per float32 block when scoring int8 codes without numba
+DEQUANTIZE_BLOCK_ROWS = 65_536
+
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _dot_scores(matrix, query):
+        scores = np.empty(matrix.shape[0], np.float32)
+        for i in numba.prange(matrix.shape[0]):
+            s = np.float32(0.0)
+            for j in range(matrix.shape[1]):
+                s += np.float32(matrix[i, j]) * query[j]
+            scores[i] = s
+        return scores
+
+
+def dot_scores(matrix, query):
+    """Return matrix @ query as float32 for a float32 or int8 matrix.
+
+    Uses the numba kernel when available (for int8 always, since it reads one byte
+    per dimension; for float32 only on small matrices where it beats BLAS start-up).
+    """
+    if numba is not None and (matrix.dtype == np.int8 or matrix.shape[0] <= NUMBA_MAX_ROWS):
+        return _dot_scores(np.asarray(matrix), query)
+    if matrix.dtype == np.int8:
+        return np.concatenate([
+            matrix[start:start + DEQUANTIZE_BLOCK_ROWS].astype(np.float32) @ query
+            for start in range(0, matrix.shape[0], DEQUANTIZE_BLOCK_ROWS)
+        ] or [np.empty(0, np.float32)])
+    return matrix @ query
+
+
+def l2_normalize(matrix):
+    """Return float32 `matrix` (a vector or one vector per row) scaled to unit length."""
+    matrix = np.array(matrix, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=-1, keepdims=True) + 1e-12
+    return matrix
+
+
+def quantize_int8(matrix):
+    """Quantize each row symmetrically to int8; returns (codes, scales) with matrix ~= codes * scales[:, None]."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def topk_cosine(matrix, query, k, scales=None):
+    """Return (row indices, scores) of the k rows of `matrix` most similar to `query`.
+
+    Both `matrix` rows and `query` must already be unit-normalized, so the dot
+    product is the cosine similarity. For int8 codes from quantize_int8, pass the
+    row `scales`. Results are sorted by descending score.
+    """
+    scores = dot_scores(matrix, query)
+    if scales is not None:
+        scores *= scales
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
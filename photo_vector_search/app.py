@@ -1,10 +1,19 @@
 
 import streamlit as st
 import os
+import sys
+import hashlib
+import tempfile
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
 from PIL import Image
-from photo_vector_search import PhotoVectorStore
-from utils import open_image
+
+# `streamlit run` puts this file's directory first on sys.path, where photo_vector_search.py would
+# shadow the package and break its relative imports, so resolve the package from the project root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from photo_vector_search.photo_vector_search import PhotoVectorStore
+from photo_vector_search.utils import open_image
 
 # Initialize session state variables
 if 'db_path' not in st.session_state:
@@ -17,9 +26,91 @@ if 'selected_image' not in st.session_state:
     st.session_state.selected_image = None
 if 'search_results' not in st.session_state:
     st.session_state.search_results = None
+if 'meta_index' not in st.session_state:
+    st.session_state.meta_index = None
+if 'unique_paths' not in st.session_state:
+    st.session_state.unique_paths = None
+
+THUMBNAIL_SIZE = 256
+DISPLAY_SIZE = 1024
+# Streamlit re-encodes PIL images as quality-100 JPEG or PNG, so hand it smaller JPEG bytes instead
+JPEG_QUALITY = 82
+
+@lru_cache(maxsize=4096)
+def basename(image_path):
+    # Called for every displayed image on every rerun
+    return os.path.basename(image_path)
+
+def encode_jpeg(img):
+    buffered = BytesIO()
+    img.convert('RGB').save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=False, progressive=False)
+    return buffered.getvalue()
+
+def load_image(image_path, max_side=DISPLAY_SIZE):
+    """Return the image downscaled to at most max_side, as JPEG bytes for st.image."""
+    with Image.open(image_path) as img:
+        # For JPEGs, let the decoder downscale while decoding instead of decoding at full size
+        img.draft('RGB', (max_side, max_side))
+        img.load()
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+        return encode_jpeg(img)
+
+def get_meta_index():
+    """Return {photo_path: [aspect metadata]}, loading it from the store once per session."""
+    if st.session_state.meta_index is None:
+        st.session_state.meta_index = st.session_state.store.load_metadata_index()
+    return st.session_state.meta_index
+
+def get_unique_paths():
+    """Return every indexed photo path, cached for the session since Streamlit reruns on each widget change."""
+    if st.session_state.unique_paths is None:
+        st.session_state.unique_paths = list(get_meta_index())
+    return st.session_state.unique_paths
+
+def invalidate_meta_index():
+    st.session_state.meta_index = None
+    st.session_state.unique_paths = None
+
+def save_upload(uploaded_file, uploads_dir):
+    """Copy an uploaded file into uploads_dir, named by its SHA-256, and return that path.
+
+    The copy is what gets indexed, so it is kept; naming it by content makes a re-upload of the
+    same image update its entry instead of adding another one.
+    """
+    uploads_dir = Path(uploads_dir)
+    uploads_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    # st.image may already have read the upload, so rewind before copying
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=uploads_dir, delete=False) as tmp:
+        while chunk := uploaded_file.read(1 << 20):
+            digest.update(chunk)
+            tmp.write(chunk)
+    upload_path = uploads_dir / f"{digest.hexdigest()}{Path(uploaded_file.name).suffix.lower()}"
+    if upload_path.exists():
+        os.remove(tmp.name)
+    else:
+        os.replace(tmp.name, upload_path)
+    return upload_path
 
-def load_image(image_path):
-    return Image.open(image_path)
+@st.cache_data(max_entries=2048, show_spinner=False)
+def load_thumbnail(image_path, mtime, thumbs_dir, size=THUMBNAIL_SIZE):
+    """Return JPEG thumbnail bytes, keyed by mtime so edited images are re-rendered."""
+    thumb_name = hashlib.sha1(f"{image_path}:{mtime}:{size}".encode()).hexdigest()
+    thumb_path = Path(thumbs_dir) / f"{thumb_name}.jpg"
+    if thumb_path.exists():
+        return thumb_path.read_bytes()
+
+    with Image.open(image_path) as img:
+        # Let the JPEG decoder downscale while decoding instead of decoding at full size
+        img.draft('RGB', (size, size))
+        img.thumbnail((size, size), Image.Resampling.BILINEAR)
+        thumbnail = encode_jpeg(img)
+
+    thumb_path.parent.mkdir(parents=True, exist_ok=True)
+    thumb_path.write_bytes(thumbnail)
+    return thumbnail
 
 def main():
     st.set_page_config(layout="wide", page_title="Photo Vector Search")
@@ -35,6 +126,7 @@ def main():
             st.session_state.image_directory = st.text_input("Image Directory", value=st.session_state.image_directory)
             if st.button("Apply Settings"):
                 st.session_state.store = PhotoVectorStore(persist_directory=st.session_state.db_path)
+                invalidate_meta_index()
                 st.success("Settings applied successfully!")
                 st.rerun()
 
@@ -47,17 +139,20 @@ def main():
 
 def view_images():
     st.header("View Images")
-    
+    if st.button("Refresh"):
+        invalidate_meta_index()
+        st.rerun()
+
     # Get all unique image paths from the database
-    all_entries = st.session_state.store.collection.get(include=["metadatas"])
-    unique_paths = list(set(entry["photo_path"] for entry in all_entries["metadatas"]))
+    unique_paths = get_unique_paths()
+    thumbs_dir = str(Path(st.session_state.db_path) / "thumbs")
 
     # Display images in a grid
     cols = st.columns(4)
     for i, image_path in enumerate(unique_paths):
         with cols[i % 4]:
-            img = load_image(image_path)
-            st.image(img, caption=Path(image_path).name, use_column_width=True)
+            thumbnail = load_thumbnail(image_path, os.path.getmtime(image_path), thumbs_dir)
+            st.image(thumbnail, caption=basename(image_path), use_column_width=True, output_format="JPEG")
             
             if st.button(f"View Details", key=f"view_{i}"):
                 st.session_state.selected_image = image_path
@@ -67,24 +162,18 @@ def view_images():
         show_image_details(st.session_state.selected_image)
 
 def show_image_details(image_path):
-    st.subheader(f"Details for {Path(image_path).name}")
+    st.subheader(f"Details for {basename(image_path)}")
     
     col1, col2 = st.columns([1, 2])
     
     with col1:
         # Display the image
         img = load_image(image_path)
-        st.image(img, caption=Path(image_path).name, use_column_width=True)
+        st.image(img, caption=basename(image_path), use_column_width=True, output_format="JPEG")
     
     with col2:
-        # Get all aspects for this image
-        entries = st.session_state.store.collection.get(
-            where={"photo_path": str(image_path)},
-            include=["metadatas"]
-        )
-        
         # Display aspects and descriptions
-        for entry in entries["metadatas"]:
+        for entry in get_meta_index().get(str(image_path), []):
             with st.expander(f"Aspect: {entry['aspect_name']}", expanded=True):
                 st.write(f"**Description:** {entry['description']}")
 
@@ -110,15 +199,11 @@ def search_images():
             st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
             if st.button("Search by Image"):
                 with st.spinner("Searching..."):
-                    # Save the uploaded file temporarily
-                    temp_path = f"temp_{uploaded_file.name}"
-                    with open(temp_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    st.session_state.search_results = st.session_state.store.search(query_image=temp_path, k=5)
-                    
-                    # Remove the temporary file
-                    os.remove(temp_path)
+                    temp_path = save_upload(uploaded_file)
+                    try:
+                        st.session_state.search_results = st.session_state.store.search(query_image=temp_path, k=5)
+                    finally:
+                        os.remove(temp_path)
                 st.rerun()
 
     if st.session_state.search_results:
@@ -134,9 +219,9 @@ def display_search_results(results):
             col1, col2 = st.columns([1, 2])
             with col1:
                 img = load_image(photo_path)
-                st.image(img, caption=Path(photo_path).name, use_column_width=True)
+                st.image(img, caption=basename(photo_path), use_column_width=True, output_format="JPEG")
             with col2:
-                st.write(f"**Image:** {Path(photo_path).name}")
+                st.write(f"**Image:** {basename(photo_path)}")
                 st.write(f"**Aspect:** {aspect}")
                 st.write(f"**Distance:** {distance:.4f}")
                 st.write(f"**Description:** {description}")
@@ -164,40 +249,34 @@ def add_image():
     if uploaded_file is not None:
         st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
         if st.button("Add Image"):
-            # Save the uploaded file temporarily
-            temp_path = f"temp_{uploaded_file.name}"
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
+            upload_path = save_upload(uploaded_file, Path(st.session_state.db_path).resolve() / "uploads")
             with st.spinner("Processing image..."):
-                success, message = st.session_state.store.add_or_update_photo(temp_path, custom_prompt, aspect_name)
-            
+                success, message = st.session_state.store.add_or_update_photo(upload_path, custom_prompt, aspect_name)
+
             if success:
+                invalidate_meta_index()
                 st.success(message)
             else:
                 st.error(message)
-            
-            # Remove the temporary file
-            os.remove(temp_path)
             st.rerun()
 
 def update_image():
     st.subheader("Update Image")
     
     # Get all unique image paths from the database
-    all_entries = st.session_state.store.collection.get(include=["metadatas"])
-    unique_paths = list(set(entry["photo_path"] for entry in all_entries["metadatas"]))
+    unique_paths = get_unique_paths()
     
     selected_image = st.selectbox("Select image to update", unique_paths)
     aspect_name = st.text_input("Aspect Name", value="default")
     custom_prompt = st.text_area("Custom Prompt (optional)")
     
     if selected_image:
-        st.image(load_image(selected_image), caption="Selected Image", use_column_width=True)
+        st.image(load_image(selected_image), caption="Selected Image", use_column_width=True, output_format="JPEG")
         if st.button("Update Image"):
             with st.spinner("Updating image..."):
                 success, message = st.session_state.store.add_or_update_photo(selected_image, custom_prompt, aspect_name)
             if success:
+                invalidate_meta_index()
                 st.success(message)
             else:
                 st.error(message)
@@ -207,14 +286,13 @@ def delete_image():
     st.subheader("Delete Image")
     
     # Get all unique image paths from the database
-    all_entries = st.session_state.store.collection.get(include=["metadatas"])
-    unique_paths = list(set(entry["photo_path"] for entry in all_entries["metadatas"]))
+    unique_paths = get_unique_paths()
     
     selected_image = st.selectbox("Select image to delete", unique_paths)
     delete_all_aspects = st.checkbox("Delete all aspects", value=True)
     
     if selected_image:
-        st.image(load_image(selected_image), caption="Selected Image", use_column_width=True)
+        st.image(load_image(selected_image), caption="Selected Image", use_column_width=True, output_format="JPEG")
         if st.button("Delete Image", type="primary"):
             with st.spinner("Deleting image..."):
                 if delete_all_aspects:
@@ -223,6 +301,7 @@ def delete_image():
                     aspect_name = st.text_input("Aspect Name to delete")
                     success, message = st.session_state.store.delete_photo(selected_image, aspect_name)
             if success:
+                invalidate_meta_index()
                 st.success(message)
             else:
                 st.error(message)
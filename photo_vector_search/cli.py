@@ -1,11 +1,15 @@
 import click
 from pathlib import Path
-from .photo_vector_search import PhotoVectorStore
 import time
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import os
 import logging
 import shutil
+import queue
+import threading
+from .utils import chunked, iter_image_files
 
 DEFAULT_DOC_SOURCE = Path.home() / "Documents" / "image_tests"
 DEFAULT_DB_PATH = Path.home() / "tmp" / "my_chroma_db"
@@ -15,15 +19,45 @@ DEFAULT_MODEL = "llava-phi3:latest"
 def cli():
     pass
 
+def open_store(**kwargs):
+    """Create a PhotoVectorStore, importing torch, chromadb and CLIP only now.
+
+    Spawned preprocessing workers re-import the module that started the CLI, so keeping these
+    imports out of module scope leaves the workers with just Pillow and NumPy.
+    """
+    from .photo_vector_search import PhotoVectorStore
+    return PhotoVectorStore(**kwargs)
+
+def hnsw_params(hnsw_m, hnsw_ef_construction, hnsw_ef_search):
+    """Return the Chroma collection metadata for the HNSW options that were given."""
+    params = {"hnsw:M": hnsw_m, "hnsw:construction_ef": hnsw_ef_construction, "hnsw:search_ef": hnsw_ef_search}
+    return {key: value for key, value in params.items() if value is not None}
+
 @cli.command()
 @click.argument('photo_directory', type=click.Path(exists=True, path_type=Path), default=DEFAULT_DOC_SOURCE)
 @click.option('--model', default=DEFAULT_MODEL, help='Ollama model to use')
 @click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory to store ChromaDB')
 @click.option('--prompt', default=None, help='Custom prompt for image description')
 @click.option('--aspect', default='default', help='Name of the aspect to index')
-@click.option('--max-workers', default=4, help='Maximum number of worker threads')
+@click.option('--max-workers', type=click.IntRange(min=1), default=None,
+              help='Number of processes decoding images (default: half the CPU cores)')
+@click.option('--max-concurrency', type=click.IntRange(min=1), default=4, help='Number of concurrent description requests to Ollama')
+@click.option('--batch-size', type=click.IntRange(1, 256, clamp=True), default=None,
+              help='Number of images to embed and store per batch (default: 128 on CUDA, 32 otherwise)')
+@click.option('--skip-existing', is_flag=True, help='Skip images already indexed with this aspect instead of re-indexing them')
+@click.option('--no-descriptions', is_flag=True, help='Only embed images, without generating descriptions with Ollama')
+@click.option('--background-descriptions', is_flag=True,
+              help='Store images as soon as they are embedded and generate their descriptions in a background thread')
+@click.option('--clip-model', default=None, help='CLIP model that embeds images when creating the store (default: ViT-L/14)')
+@click.option('--compile', 'compile_model', is_flag=True,
+              help='Compile the CLIP model with torch.compile; slower to start, faster on large directories')
+@click.option('--hnsw-m', type=int, default=None, help='HNSW links per node when creating the store (default: 24)')
+@click.option('--hnsw-ef-construction', type=int, default=None, help='HNSW build-time candidate list size when creating the store (default: 128)')
+@click.option('--hnsw-ef-search', type=int, default=None, help='HNSW query-time candidate list size when creating the store (default: 100)')
 @click.option('--debug', is_flag=True, help='Enable debug logging')
-def index_photos(photo_directory, model, db_path, prompt, aspect, max_workers, debug):
+def index_photos(photo_directory, model, db_path, prompt, aspect, max_workers, max_concurrency, batch_size,
+                 skip_existing, no_descriptions, background_descriptions, clip_model, compile_model,
+                 hnsw_m, hnsw_ef_construction, hnsw_ef_search, debug):
     if debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
@@ -36,45 +70,177 @@ def index_photos(photo_directory, model, db_path, prompt, aspect, max_workers, d
     logger.info(f"Prompt: {prompt}")
     logger.info(f"Aspect: {aspect}")
 
-    store = PhotoVectorStore(model_name=model, persist_directory=str(db_path))
+    try:
+        store = open_store(model_name=model, persist_directory=str(db_path), clip_model_name=clip_model,
+                           compile_model=compile_model,
+                           hnsw_params=hnsw_params(hnsw_m, hnsw_ef_construction, hnsw_ef_search))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--clip-model')
+    if batch_size is None:
+        batch_size = 128 if store.device == "cuda" else 32
+    logger.info(f"Batch size: {batch_size}")
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 2) // 2)
+    background_descriptions = background_descriptions and not no_descriptions
+    # Whether add_prepared_photos describes each batch before storing it
+    describe_now = not (no_descriptions or background_descriptions)
     
-    image_files = list(photo_directory.rglob("*"))
-    image_files = [f for f in image_files if f.suffix.lower() in ('.png', '.jpg', '.jpeg')]
-    logger.info(f"Found {len(image_files)} image files")
+    # Decoder threads hash each image and hand cache misses to worker processes, which decode,
+    # resize and encode them outside the GIL. Prepared images go into a bounded queue while the
+    # main thread embeds, describes and stores them in batches, so decoding overlaps with the models.
+    preprocess_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    # One bulk read of entry ids instead of a lookup per file
+    indexed_paths = store.indexed_photo_paths(aspect) if skip_existing else set()
+    skipped_count = 0
+
+    def iter_new_images():
+        nonlocal skipped_count
+        for photo_path in iter_image_files(photo_directory):
+            if str(Path(photo_path)) in indexed_paths:
+                skipped_count += 1
+            else:
+                yield photo_path
+
+    image_paths = iter_new_images()
+    image_paths_lock = threading.Lock()
+    decoded = queue.Queue(maxsize=4 * batch_size)
+
+    def decode_images():
+        while True:
+            with image_paths_lock:
+                photo_path = next(image_paths, None)
+            if photo_path is None:
+                return
+            decoded.put(store.prepare_photo(photo_path, custom_prompt=prompt, aspect_name=aspect,
+                                            executor=preprocess_pool, describe=describe_now))
+
+    def run_decoders():
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for future in [executor.submit(decode_images) for _ in range(max_workers)]:
+                    future.result()
+        except Exception as e:
+            logger.error(f"Error while reading images: {str(e)}", exc_info=True)
+        finally:
+            decoded.put(None)
 
-    def process_image(file_path):
-        logger.debug(f"Processing {file_path}")
-        success, message = store.add_or_update_photo(file_path, custom_prompt=prompt, aspect_name=aspect)
-        logger.debug(f"Result for {file_path}: {message}")
-        return success, message
+    def iter_decoded():
+        while (item := decoded.get()) is not None:
+            yield item
 
     successful_count = 0
     error_count = 0
+    # Batches of stored photo paths waiting for descriptions, consumed by describe_in_background
+    to_describe = queue.Queue()
+    described_count = 0
+    description_error_count = 0
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_image, file_path) for file_path in image_files]
-        for future in tqdm(as_completed(futures), total=len(image_files), desc="Indexing Progress"):
-            success, message = future.result()
-            if success:
-                successful_count += 1
-            else:
-                error_count += 1
-            tqdm.write(message)
+    def describe_in_background():
+        nonlocal described_count, description_error_count
+        while (photo_paths := to_describe.get()) is not None:
+            try:
+                results = store.describe_photos(photo_paths, custom_prompt=prompt, aspect_name=aspect,
+                                                max_workers=max_concurrency)
+            except Exception as e:
+                logger.error(f"Error while describing images: {str(e)}", exc_info=True)
+                description_error_count += len(photo_paths)
+                continue
+            for success, message in results:
+                if success:
+                    described_count += 1
+                else:
+                    description_error_count += 1
+                tqdm.write(message)
+
+    describer = threading.Thread(target=describe_in_background, daemon=True)
+    if background_descriptions:
+        describer.start()
+
+    if not no_descriptions:
+        # Load the description model while the first images are decoded and embedded
+        threading.Thread(target=store.warm_up_description_model, daemon=True).start()
+    threading.Thread(target=run_decoders, daemon=True).start()
+    # The directory walk is streamed, so the total is unknown up front
+    with preprocess_pool, tqdm(desc="Indexing Progress", unit="image") as progress:
+        for batch in chunked(iter_decoded(), batch_size):
+            logger.debug(f"Processing batch of {len(batch)} images")
+            results = store.add_prepared_photos(batch, custom_prompt=prompt, aspect_name=aspect,
+                                                max_workers=max_concurrency, describe=describe_now)
+            for success, message in results:
+                if success:
+                    successful_count += 1
+                else:
+                    error_count += 1
+                tqdm.write(message)
+            progress.update(len(results))
+            if background_descriptions:
+                to_describe.put([item.photo_path for item, (success, _) in zip(batch, results) if success])
 
     logger.info(f"\nIndexing complete:")
     logger.info(f"Successfully processed: {successful_count} images")
     logger.info(f"Errors encountered: {error_count} images")
+    if skip_existing:
+        logger.info(f"Skipped (already indexed): {skipped_count} images")
+
+    if background_descriptions:
+        logger.info(f"Waiting for descriptions of {to_describe.qsize()} batches")
+        to_describe.put(None)
+        describer.join()
+        logger.info(f"Descriptions generated: {described_count} images")
+        logger.info(f"Description errors: {description_error_count} images")
 
 @cli.command()
-@click.argument('photo_path', type=click.Path(exists=True, path_type=Path))
+@click.option('--model', default=DEFAULT_MODEL, help='Ollama model to use')
+@click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory where ChromaDB is stored')
+@click.option('--prompt', default=None, help='Custom prompt for image description')
+@click.option('--aspect', default='default', help='Name of the aspect to describe')
+@click.option('--max-concurrency', type=click.IntRange(min=1), default=4, help='Number of concurrent description requests to Ollama')
+@click.option('--batch-size', type=click.IntRange(1, 256, clamp=True), default=32, help='Number of descriptions to store per update')
+@click.option('--debug', is_flag=True, help='Enable debug logging')
+def describe_photos(model, db_path, prompt, aspect, max_concurrency, batch_size, debug):
+    """Generate descriptions for indexed images stored without one."""
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    store = open_store(model_name=model, persist_directory=str(db_path))
+    photo_paths = store.photos_missing_descriptions(aspect)
+    logger.info(f"Describing {len(photo_paths)} images with aspect '{aspect}'")
+
+    error_count = 0
+    with tqdm(total=len(photo_paths), desc="Describing", unit="image") as progress:
+        for batch in chunked(photo_paths, batch_size):
+            for success, message in store.describe_photos(batch, custom_prompt=prompt, aspect_name=aspect,
+                                                          max_workers=max_concurrency):
+                if not success:
+                    error_count += 1
+                tqdm.write(message)
+            progress.update(len(batch))
+    logger.info(f"Errors encountered: {error_count} images")
+
+@cli.command()
+@click.argument('photo_paths', nargs=-1, required=True, type=click.Path(exists=True, path_type=Path))
 @click.option('--model', default=DEFAULT_MODEL, help='Ollama model to use')
 @click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory where ChromaDB is stored')
 @click.option('--prompt', required=True, help='Custom prompt for the new aspect')
 @click.option('--aspect', required=True, help='Name of the new aspect')
-def add_aspect(photo_path, model, db_path, prompt, aspect):
-    store = PhotoVectorStore(model_name=model, persist_directory=str(db_path))
-    store.add_or_update_photo(photo_path, custom_prompt=prompt, aspect_name=aspect)
-    click.echo(f"Added aspect '{aspect}' to {photo_path}")
+@click.option('--max-concurrency', type=click.IntRange(min=1), default=4,
+              help='Number of photos decoded, and description requests sent to Ollama, at once')
+@click.option('--batch-size', type=click.IntRange(1, 256, clamp=True), default=32,
+              help='Number of photos to embed and store per batch')
+def add_aspect(photo_paths, model, db_path, prompt, aspect, max_concurrency, batch_size):
+    store = open_store(model_name=model, persist_directory=str(db_path))
+    for batch in chunked(photo_paths, batch_size):
+        results = store.add_or_update_photos_batch(batch, custom_prompt=prompt, aspect_name=aspect,
+                                                   max_workers=max_concurrency)
+        for photo_path, (success, message) in zip(batch, results):
+            click.echo(f"Added aspect '{aspect}' to {photo_path}" if success else message)
+
+def open_search_store(model, db_path, sem_cache_threshold, sem_cache_ttl, ann):
+    try:
+        return open_store(model_name=model, persist_directory=str(db_path), sem_cache_threshold=sem_cache_threshold,
+                          sem_cache_ttl=sem_cache_ttl, ann_backend=ann)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--ann')
 
 @cli.command()
 @click.argument('query_image', type=click.Path(exists=True, path_type=Path))
@@ -84,9 +250,17 @@ def add_aspect(photo_path, model, db_path, prompt, aspect):
 @click.option('--aspect', default=None, help='Aspect to search by (leave empty to search all aspects)')
 @click.option('--verbose', is_flag=True, help='Display detailed information including descriptions')
 @click.option('--view', is_flag=True, help='Open images for viewing')
-def search_photos(query_image, model, db_path, k, aspect, verbose, view):
-    store = PhotoVectorStore(model_name=model, persist_directory=str(db_path))
-    results = store.search(query_image=query_image, aspect_name=aspect, k=k)
+@click.option('--sem-cache-threshold', default=0.97, help='Cosine similarity at which a recent query\'s results are reused (above 1 disables)')
+@click.option('--sem-cache-ttl', default=300.0, help='Seconds a cached query result stays valid')
+@click.option('--exact', is_flag=True, help='Score every stored embedding instead of using the approximate HNSW index')
+@click.option('--ann', type=click.Choice(['chroma', 'usearch']), default='chroma',
+              help='Approximate index to search (usearch needs the usearch extra)')
+def search_photos(query_image, model, db_path, k, aspect, verbose, view, sem_cache_threshold, sem_cache_ttl, exact, ann):
+    store = open_search_store(model, db_path, sem_cache_threshold, sem_cache_ttl, ann)
+    try:
+        results = store.search(query_image=query_image, aspect_name=aspect, k=k, exact=exact)
+    finally:
+        store.close()
 
     for photo_path, aspect_name, distance, description in results:
         click.echo(f"Photo: {photo_path}")
@@ -106,16 +280,21 @@ def search_photos(query_image, model, db_path, k, aspect, verbose, view):
 @click.option('--aspect', default=None, help='Aspect to search by (leave empty to search all aspects)')
 @click.option('--verbose', count=True, help='Increase output verbosity (e.g., -v, -vv, -vvv)')
 @click.option('--view', is_flag=True, help='Open images for viewing')
-def search_photos_by_text(query_text, model, db_path, k, aspect, verbose, view):
+@click.option('--sem-cache-threshold', default=0.97, help='Cosine similarity at which a recent query\'s results are reused (above 1 disables)')
+@click.option('--sem-cache-ttl', default=300.0, help='Seconds a cached query result stays valid')
+@click.option('--exact', is_flag=True, help='Score every stored embedding instead of using the approximate HNSW index')
+@click.option('--ann', type=click.Choice(['chroma', 'usearch']), default='chroma',
+              help='Approximate index to search (usearch needs the usearch extra)')
+def search_photos_by_text(query_text, model, db_path, k, aspect, verbose, view, sem_cache_threshold, sem_cache_ttl, exact, ann):
     log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
     log_level = log_levels[min(verbose, len(log_levels) - 1)]
     logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
 
     logger = logging.getLogger(__name__)
-    store = PhotoVectorStore(model_name=model, persist_directory=str(db_path))
+    store = open_search_store(model, db_path, sem_cache_threshold, sem_cache_ttl, ann)
     
     try:
-        results = store.search(query_text=query_text, aspect_name=aspect, k=k)
+        results = store.search(query_text=query_text, aspect_name=aspect, k=k, exact=exact)
         
         if not results:
             click.echo("No results found.")
@@ -132,9 +311,12 @@ def search_photos_by_text(query_text, model, db_path, k, aspect, verbose, view):
     except Exception as e:
         logger.error(f"An error occurred during search: {str(e)}", exc_info=True)
         click.echo(f"An error occurred during search. Please check the logs for more details.")
+    finally:
+        store.close()
 
 @cli.command()
 def list_models():
+    from .photo_vector_search import PhotoVectorStore
     models = PhotoVectorStore.list_available_models()
     click.echo("Available models:")
     for model in models:
@@ -144,13 +326,28 @@ def list_models():
 @click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory where ChromaDB is stored')
 def clear_store(db_path):
     """Remove all entries from the vector store without deleting the database directory."""
-    store = PhotoVectorStore(persist_directory=str(db_path))
+    store = open_store(persist_directory=str(db_path))
     try:
-        store.collection.delete(where={})
+        store.clear()
         click.echo(f"Cleared all entries from the vector store at '{db_path}'.")
     except Exception as e:
         click.echo(f"An error occurred while clearing the vector store: {str(e)}")
 
+@cli.command()
+@click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory where ChromaDB is stored')
+@click.option('--hnsw-m', type=int, default=None, help='HNSW links per node (default: keep the current value)')
+@click.option('--hnsw-ef-construction', type=int, default=None, help='HNSW build-time candidate list size (default: keep the current value)')
+@click.option('--hnsw-ef-search', type=int, default=None, help='HNSW query-time candidate list size (default: keep the current value)')
+def optimize_store(db_path, hnsw_m, hnsw_ef_construction, hnsw_ef_search):
+    """Rebuild the vector index with new HNSW parameters, keeping every entry."""
+    store = open_store(persist_directory=str(db_path))
+    try:
+        store.rebuild_index(hnsw_params(hnsw_m, hnsw_ef_construction, hnsw_ef_search))
+        settings = ", ".join(f"{key}={value}" for key, value in store.collection.metadata.items())
+        click.echo(f"Rebuilt the vector index at '{db_path}' with {settings}.")
+    except Exception as e:
+        click.echo(f"An error occurred while rebuilding the vector index: {str(e)}")
+
 @cli.command()
 @click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory where ChromaDB is stored')
 def delete_store(db_path):
@@ -168,7 +365,7 @@ def delete_store(db_path):
 @click.option('--db-path', type=click.Path(path_type=Path), default=DEFAULT_DB_PATH, help='Directory where ChromaDB is stored')
 def examine_image(photo_path, db_path):
     """Examine the details of a single indexed image."""
-    store = PhotoVectorStore(persist_directory=str(db_path))
+    store = open_store(persist_directory=str(db_path))
     photo_path = str(Path(photo_path))
     entries = store.collection.get(
         where={"photo_path": photo_path},
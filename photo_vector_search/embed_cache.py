@@ -0,0 +1,107 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file's contents."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent cache of image embeddings and descriptions keyed by file content.
+
+    Entries are keyed by (sha256, model, aspect, prompt), so renaming or copying a
+    file still hits the cache while editing it does not. Least recently used
+    entries are evicted past `max_entries`, and entries older than `ttl` seconds
+    are ignored when a TTL is given.
+    """
+
+    # Hits refresh an entry's last-used time at most this often, so repeated lookups stay read-only
+    TOUCH_INTERVAL = 3600.0
+
+    def __init__(self, db_file, max_entries=100_000, ttl=None):
+        self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_interval = self.TOUCH_INTERVAL if ttl is None else min(self.TOUCH_INTERVAL, ttl / 2)
+        self._local = threading.local()
+        self._puts = 0
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " sha256 TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " aspect TEXT NOT NULL,"
+            " prompt TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " description TEXT NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " PRIMARY KEY (sha256, model, aspect, prompt))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_mtime ON cache (mtime)")
+        conn.commit()
+
+    def _connection(self):
+        # sqlite connections cannot be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sha256, model, aspect, prompt=None):
+        """Return (embedding, description) for a cached entry, or None on a miss."""
+        conn = self._connection()
+        key = (sha256, model, aspect, prompt or "")
+        row = conn.execute(
+            "SELECT embedding, description, mtime FROM cache"
+            " WHERE sha256 = ? AND model = ? AND aspect = ? AND prompt = ?",
+            key
+        ).fetchone()
+        if row is None:
+            return None
+
+        embedding, description, mtime = row
+        now = time.time()
+        if self.ttl is not None and now - mtime > self.ttl:
+            return None
+
+        if now - mtime > self.touch_interval:
+            conn.execute(
+                "UPDATE cache SET mtime = ? WHERE sha256 = ? AND model = ? AND aspect = ? AND prompt = ?",
+                (now, *key)
+            )
+            conn.commit()
+        return np.frombuffer(embedding, dtype=np.float32).tolist(), description
+
+    def put(self, sha256, model, aspect, prompt, embedding, description):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (sha256, model, aspect, prompt, embedding, description, mtime)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sha256, model, aspect, prompt or "", np.asarray(embedding, dtype=np.float32).tobytes(),
+             description, time.time())
+        )
+        self._puts += 1
+        if self._puts % 256 == 0:
+            self._evict(conn)
+        conn.commit()
+
+    def _evict(self, conn):
+        conn.execute(
+            "DELETE FROM cache WHERE rowid IN"
+            " (SELECT rowid FROM cache ORDER BY mtime DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        if self.ttl is not None:
+            conn.execute("DELETE FROM cache WHERE mtime < ?", (time.time() - self.ttl,))
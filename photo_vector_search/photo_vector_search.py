@@ -1,173 +1,671 @@
 import logging
 import json
+import shutil
+import sqlite3
+import threading
+import uuid
+import numpy as np
 from pathlib import Path
 from PIL import Image
-from io import BytesIO
-from ollama import generate
 import chromadb
 import torch
 import clip
-import base64
+import httpx
+try:
+    from usearch.index import Index as USearchIndex
+except ImportError:  # usearch is an optional approximate index
+    USearchIndex = None
 from ollama import Client
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, namedtuple
+from contextlib import closing
+from .embed_cache import EmbeddingCache, file_sha256
+from .query_cache import QueryCache
+from ._kernels import l2_normalize, quantize_int8, topk_cosine
+from .preprocess import CLIP_MEAN, CLIP_STD, description_image_bytes, preprocess_photo
+
+# CLIP model for new stores; a store records the model it was created with in its collection metadata
+CLIP_MODEL_NAME = "ViT-L/14"
+# HNSW parameters for new collections; Chroma's defaults (M=16, construction_ef=100, search_ef=10)
+# lose recall as the collection grows. Larger batch/sync thresholds than Chroma's (100/1000) mean
+# fewer index insert passes and disk syncs during bulk indexing. hnswlib raises search_ef to k
+# itself, so queries with k above it still search k candidates.
+HNSW_DEFAULTS = {"hnsw:M": 24, "hnsw:construction_ef": 128, "hnsw:search_ef": 100,
+                 "hnsw:batch_size": 200, "hnsw:sync_threshold": 2000}
+# How long Ollama keeps the description model loaded after a request, so later runs skip the cold start
+OLLAMA_KEEP_ALIVE = "24h"
+
+# A photo ready for add_prepared_photos: `cached` is a cached (embedding, description) or None,
+# `image`/`description_image` are the CLIP input tensor and description image bytes on a cache
+# miss, and `error` is a message if the photo could not be read.
+PreparedPhoto = namedtuple(
+    "PreparedPhoto", ["photo_path", "content_hash", "cached", "image", "description_image", "error"]
+)
 
 class PhotoVectorStore:
-    def __init__(self, model_name='llava-phi3:latest', persist_directory='./chroma_db'):
+    def __init__(self, model_name='llava-phi3:latest', persist_directory='./chroma_db',
+                 sem_cache_threshold=0.97, sem_cache_ttl=300.0, hnsw_params=None, clip_model_name=None,
+                 ann_backend="chroma", compile_model=False):
         self.model_name = model_name
-        self.chroma_client = chromadb.PersistentClient(path=str(Path(persist_directory).resolve()))
+        self.persist_directory = Path(persist_directory).resolve()
+        self.chroma_client = chromadb.PersistentClient(path=str(self.persist_directory))
+        self.embed_cache = EmbeddingCache(self.persist_directory / "embed_cache.sqlite")
+        self.query_cache = QueryCache(threshold=sem_cache_threshold, ttl=sem_cache_ttl)
+        self._quantized = None
+        self._quantized_lock = threading.Lock()
+        self.quantized_directory = self.persist_directory / "quantized"
+        if ann_backend == "usearch" and USearchIndex is None:
+            raise ValueError("The usearch backend needs the usearch package (poetry install --extras usearch)")
+        self.ann_backend = ann_backend
+        self._usearch = None
+        self._usearch_lock = threading.Lock()
+        self.usearch_directory = self.persist_directory / "usearch"
+        self._restore_interrupted_rebuild("photo_collection")
         self.collection = self.chroma_client.get_or_create_collection(
             name="photo_collection",
-            metadata={"hnsw:space": "cosine"}
+            metadata={"hnsw:space": "cosine", "clip_model": clip_model_name or CLIP_MODEL_NAME,
+                      **HNSW_DEFAULTS, **(hnsw_params or {})}
         )
+        # Embeddings from different CLIP models are not comparable, so a store keeps its original model.
+        # Stores created before the model was recorded used CLIP_MODEL_NAME.
+        self.clip_model_name = (self.collection.metadata or {}).get("clip_model", CLIP_MODEL_NAME)
+        if clip_model_name is not None and clip_model_name != self.clip_model_name:
+            raise ValueError(f"The store at {self.persist_directory} uses CLIP model {self.clip_model_name}, "
+                             f"not {clip_model_name}")
+
+        # One pooled client for the store, so description requests reuse keep-alive connections.
+        # The transport retries requests whose connection failed.
+        self.ollama_client = Client(transport=httpx.HTTPTransport(
+            retries=3,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+        ))
         
         # Set up logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
+        # HNSW parameters only apply when the collection is created
+        current = self.collection.metadata or {}
+        if any(current.get(key) != value for key, value in (hnsw_params or {}).items()):
+            self.logger.warning("The collection already exists with different HNSW parameters; "
+                                "run optimize-store to rebuild it with new ones")
+
         # Initialize CLIP-L model
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.clip_model, self.clip_preprocess = clip.load("ViT-L/14", device=self.device)
+        self.clip_model, self.clip_preprocess = clip.load(self.clip_model_name, device=self.device)
+        if compile_model:
+            # Compiling takes a while on the first batch and for each new batch size, so it only
+            # pays off for long indexing runs; CUDA graphs cut the per-kernel launch overhead
+            mode = "reduce-overhead" if self.device == "cuda" else None
+            self.clip_model.encode_image = torch.compile(self.clip_model.encode_image, mode=mode)
+            self.clip_model.encode_text = torch.compile(self.clip_model.encode_text, mode=mode)
+        # Batched inputs arrive as uint8 (see clip_input_array) and are normalized on the device
+        self._clip_mean = torch.from_numpy(CLIP_MEAN).to(self.device).view(3, 1, 1)
+        self._clip_std = torch.from_numpy(CLIP_STD).to(self.device).view(3, 1, 1)
+        self.cache_model_key = f"{self.clip_model_name}|{self.model_name}"
+
+        # Query embeddings from earlier runs, so repeated CLI searches skip the model
+        self.query_cache_file = self.persist_directory / "query_cache.npz"
+        self.query_cache.load_embeddings(self.query_cache_file, self.clip_model_name)
 
     def _get_image_embedding(self, image_path):
-        image = self.clip_preprocess(Image.open(image_path)).unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            embedding = self.clip_model.encode_image(image).cpu().numpy()[0]
-        return embedding.tolist()
+        # Decoded and preprocessed exactly like a batched photo, so both paths give the same embedding
+        clip_input, _ = preprocess_photo(image_path, self.clip_model.visual.input_resolution, describe=False)
+        return self._get_image_embeddings([torch.from_numpy(clip_input)])[0]
+
+    def _get_image_embeddings(self, images):
+        batch = None
+        split = False
+        try:
+            batch = torch.stack(images)
+            if self.device == "cuda":
+                # Copying from page-locked memory lets the transfer run without a staging copy
+                batch = batch.pin_memory()
+            batch = batch.to(self.device, non_blocking=True)
+            with torch.inference_mode():
+                batch = (batch.float() / 255.0 - self._clip_mean) / self._clip_std
+                embeddings = self.clip_model.encode_image(batch).cpu().numpy()
+        except RuntimeError as e:
+            # Usually out of memory: retry the two halves separately
+            if len(images) == 1:
+                raise
+            self.logger.warning(f"Embedding {len(images)} images at once failed ({str(e)}), splitting the batch")
+            split = True
+        if split:
+            # Outside the handler, so the traceback no longer holds the failed batch's tensors
+            del batch
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            half = len(images) // 2
+            return self._get_image_embeddings(images[:half]) + self._get_image_embeddings(images[half:])
+        return l2_normalize(embeddings).tolist()
 
     def _get_text_embedding(self, text):
         text_tokens = clip.tokenize([text]).to(self.device)
-        with torch.no_grad():
+        with torch.inference_mode():
             embedding = self.clip_model.encode_text(text_tokens).cpu().numpy()[0]
-        return embedding.tolist()
+        return l2_normalize(embedding).tolist()
     
-    def _generate_description_with_ollama(self, photo_path, custom_prompt=None):
+    def _generate_description_with_ollama(self, photo_path, custom_prompt=None, image_bytes=None):
         prompt = custom_prompt or "Describe this image in detail."
-        self.logger.debug(f"Generating description for {photo_path} with prompt: {prompt}")
+        self.logger.debug("Generating description for %s with prompt: %s", photo_path, prompt)
 
         try:
-            # Open and preprocess the image
-            with Image.open(photo_path) as img:
-                # Ensure the image is in RGB mode
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                # Resize the image if necessary
-                if max(img.size) > 1024:
-                    img.thumbnail((1024, 1024))
-                # Save the image to a BytesIO object
-                buffered = BytesIO()
-                img.save(buffered, format="PNG")
-                image_bytes = buffered.getvalue()
-
-            # Encode the image in base64
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            if image_bytes is None:
+                # Open and preprocess the image; small JPEGs are sent without decoding them
+                with Image.open(photo_path) as img:
+                    image_bytes = description_image_bytes(photo_path, img)
 
             # Build the payload
             payload = {
                 "model": self.model_name,
                 "prompt": prompt,
-                "images": [image_base64],
-                "stream": False
+                # Raw bytes: the client base64-encodes them once, while a base64 string would be
+                # decoded again just to validate it
+                "images": [image_bytes],
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE
             }
 
-            # Create the Ollama client
-            client = Client()
-
             # Send the request and get the response
-            response = client.generate(**payload)
+            response = self.ollama_client.generate(**payload)
 
             description = response['response'].strip()
-            self.logger.debug(f"Generated description: {description}")
+            self.logger.debug("Generated description: %s", description)
             return description
         except Exception as e:
             self.logger.error(f"Ollama generate error: {str(e)}", exc_info=True)
             return ''
 
 
-    def _preprocess_image(self, img):
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        if max(img.size) > 1024:
-            img.thumbnail((1024, 1024))
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return buffered.getvalue()  # Return raw bytes
+    def warm_up_description_model(self):
+        """Ask Ollama to load the description model now, so the first description does not wait for it."""
+        try:
+            # A generate request without a prompt only loads the model
+            self.ollama_client.generate(model=self.model_name, keep_alive=OLLAMA_KEEP_ALIVE)
+        except Exception as e:
+            self.logger.warning(f"Could not preload {self.model_name}: {str(e)}")
 
     def add_or_update_photo(self, photo_path, custom_prompt=None, aspect_name="default"):
         photo_path = Path(photo_path)
         self.logger.info(f"Processing image: {photo_path}")
 
         try:
-            self.logger.debug(f"Generating embedding for {photo_path}")
-            embedding = self._get_image_embedding(photo_path)
-            self.logger.debug(f"Generated embedding (length: {len(embedding)})")
+            content_hash = file_sha256(photo_path)
+            cached = self.embed_cache.get(content_hash, self.cache_model_key, aspect_name, custom_prompt)
         except Exception as e:
-            self.logger.error(f"Error generating embedding for {photo_path}: {str(e)}", exc_info=True)
-            return False, f"Error generating embedding: {str(e)}"
+            self.logger.error(f"Error reading {photo_path}: {str(e)}", exc_info=True)
+            return False, f"Error reading image: {str(e)}"
 
+        if cached is not None:
+            self.logger.debug("Using cached embedding and description for %s", photo_path)
+            embedding, description = cached
+        else:
+            try:
+                self.logger.debug("Generating embedding for %s", photo_path)
+                embedding = self._get_image_embedding(photo_path)
+                self.logger.debug("Generated embedding (length: %d)", len(embedding))
+            except Exception as e:
+                self.logger.error(f"Error generating embedding for {photo_path}: {str(e)}", exc_info=True)
+                return False, f"Error generating embedding: {str(e)}"
+
+            try:
+                # Generate description using Ollama and llava-phi3
+                description = self._generate_description_with_ollama(photo_path, custom_prompt)
+            except Exception as e:
+                self.logger.error(f"Error generating description for {photo_path}: {str(e)}", exc_info=True)
+                return False, f"Error generating description: {str(e)}"
+
+            # An empty description means Ollama failed; don't cache it so the next run retries
+            if description:
+                self.embed_cache.put(content_hash, self.cache_model_key, aspect_name, custom_prompt, embedding, description)
+
+        # Store in the database; upsert adds or replaces the entry in one call
         try:
-            # Generate description using Ollama and llava-phi3
-            description = self._generate_description_with_ollama(photo_path, custom_prompt)
-            self.logger.debug(f"Generated description: {description}")
+            self.logger.debug("Upserting entry for %s and aspect '%s'", photo_path, aspect_name)
+            self.upsert_batch([(
+                f"{str(photo_path)}_{aspect_name}",
+                embedding,
+                {"photo_path": str(photo_path), "aspect_name": aspect_name, "description": description,
+                 "content_hash": content_hash}
+            )])
+            return True, f"Indexed {photo_path.name} with aspect '{aspect_name}'"
         except Exception as e:
-            self.logger.error(f"Error generating description for {photo_path}: {str(e)}", exc_info=True)
-            return False, f"Error generating description: {str(e)}"
+            self.logger.error(f"Error updating ChromaDB for {photo_path}: {str(e)}", exc_info=True)
+            return False, f"Database update error: {str(e)}"
+
+    def prepare_photo(self, photo_path, custom_prompt=None, aspect_name="default", executor=None, describe=True):
+        """Hash a photo, check the embedding cache and, on a miss, decode and preprocess it.
 
-        # Store in the database
+        The decode/resize/encode work runs on `executor` (e.g. a ProcessPoolExecutor) when given.
+        Without `describe`, no description image is encoded.
+        """
+        photo_path = Path(photo_path)
         try:
-            self.logger.debug(f"Checking for existing entries for {photo_path} and aspect '{aspect_name}'")
-            existing_entries = self.collection.get(
-                where={
-                    "$and": [
-                        {"photo_path": str(photo_path)},
-                        {"aspect_name": aspect_name}
-                    ]
-                },
-                include=["metadatas", "documents"]
-            )
-
-            entry_id = f"{str(photo_path)}_{aspect_name}"
-            metadata = {
-                "photo_path": str(photo_path),
-                "aspect_name": aspect_name,
-                "description": description
-            }
+            content_hash = file_sha256(photo_path)
+            cached = self.embed_cache.get(content_hash, self.cache_model_key, aspect_name, custom_prompt)
+            if cached is not None:
+                return PreparedPhoto(photo_path, content_hash, cached, None, None, None)
 
-            if existing_entries['ids']:
-                self.logger.debug(f"Updating existing entry for {photo_path} and aspect '{aspect_name}'")
-                self.collection.update(
-                    ids=[entry_id],
-                    embeddings=[embedding],
-                    metadatas=[metadata],
-                    documents=[description]
-                )
-                return True, f"Updated existing entry for {photo_path.name} with aspect '{aspect_name}'"
+            n_px = self.clip_model.visual.input_resolution
+            if executor is None:
+                clip_input, description_image = preprocess_photo(photo_path, n_px, describe)
             else:
-                self.logger.debug(f"Adding new entry for {photo_path} and aspect '{aspect_name}'")
-                self.collection.add(
-                    ids=[entry_id],
-                    embeddings=[embedding],
-                    documents=[description],
-                    metadatas=[metadata]
-                )
-                return True, f"Added new entry for {photo_path.name} with aspect '{aspect_name}'"
+                clip_input, description_image = executor.submit(preprocess_photo, photo_path, n_px, describe).result()
+            return PreparedPhoto(photo_path, content_hash, None, torch.from_numpy(clip_input), description_image, None)
         except Exception as e:
-            self.logger.error(f"Error updating ChromaDB for {photo_path}: {str(e)}", exc_info=True)
-            return False, f"Database update error: {str(e)}"
+            self.logger.error(f"Error loading {photo_path}: {str(e)}", exc_info=True)
+            return PreparedPhoto(photo_path, None, None, None, None,
+                                 f"Error generating embedding for {photo_path.name}: {str(e)}")
 
-    def search(self, query_image=None, query_text=None, aspect_name=None, k=5):
-        self.logger.info(f"Searching with aspect: {aspect_name}, k: {k}")
-        if query_image:
-            self.logger.debug(f"Processing query image: {query_image}")
-            embedding = self._get_image_embedding(query_image)
-        elif query_text:
-            self.logger.debug(f"Processing query text: {query_text}")
-            embedding = self._get_text_embedding(query_text)
+    def add_or_update_photos_batch(self, photo_paths, custom_prompt=None, aspect_name="default", max_workers=4):
+        """Embed a batch of photos in one CLIP forward pass and store them with a single upsert.
+
+        Photos are hashed and decoded on `max_workers` threads, which also bounds the concurrent
+        description requests. Returns a list of (success, message) tuples in the same order as
+        `photo_paths`.
+        """
+        # Pillow and hashlib release the GIL while decoding and hashing
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            prepared = list(executor.map(lambda p: self.prepare_photo(p, custom_prompt, aspect_name), photo_paths))
+        return self.add_prepared_photos(prepared, custom_prompt, aspect_name, max_workers)
+
+    def add_prepared_photos(self, prepared, custom_prompt=None, aspect_name="default", max_workers=4, describe=True):
+        """Store a batch of PreparedPhotos from prepare_photo; see add_or_update_photos_batch.
+
+        Without `describe`, photos missing from the cache keep the description already stored for
+        their contents, if any; the others are stored with an empty description and are not cached,
+        so a later run with descriptions processes them again.
+        """
+        self.logger.info(f"Processing batch of {len(prepared)} images")
+        photo_paths = [item.photo_path for item in prepared]
+        photo_hashes = {item.photo_path: item.content_hash for item in prepared}
+        results = {}
+        embeddings = {}
+        descriptions = {}
+        content_hashes = {}
+        description_images = {}
+
+        images = []
+        uncached_paths = []
+        # Photos with identical contents are embedded and described once: {duplicate path: first path}
+        first_with_hash = {}
+        duplicates = {}
+        for photo_path, content_hash, cached, image, description_image, error in prepared:
+            if error is None and cached is None:
+                if content_hash in first_with_hash:
+                    duplicates[photo_path] = first_with_hash[content_hash]
+                    continue
+                # A copy in an earlier batch may have been cached since prepare_photo checked
+                cached = self.embed_cache.get(content_hash, self.cache_model_key, aspect_name, custom_prompt)
+
+            if error is not None:
+                results[photo_path] = (False, error)
+            elif cached is not None:
+                self.logger.debug("Using cached embedding and description for %s", photo_path)
+                embeddings[photo_path], descriptions[photo_path] = cached
+            else:
+                first_with_hash[content_hash] = photo_path
+                content_hashes[photo_path] = content_hash
+                description_images[photo_path] = description_image
+                images.append(image)
+                uncached_paths.append(photo_path)
+
+        if uncached_paths:
+            try:
+                self.logger.debug("Generating embeddings for %d images", len(uncached_paths))
+                embeddings.update(zip(uncached_paths, self._get_image_embeddings(images)))
+            except Exception as e:
+                self.logger.error(f"Error generating embeddings for batch: {str(e)}", exc_info=True)
+                for photo_path in uncached_paths:
+                    results[photo_path] = (False, f"Error generating embedding for {photo_path.name}: {str(e)}")
+                uncached_paths = []
+
+        if uncached_paths and not describe:
+            # Keep descriptions already stored for these photos' current contents instead of blanking them
+            entry_paths = {f"{str(p)}_{aspect_name}": p for p in uncached_paths}
+            entries = self.collection.get(ids=list(entry_paths), include=["metadatas"])
+            for entry_id, metadata in zip(entries["ids"], entries["metadatas"]):
+                photo_path = entry_paths[entry_id]
+                # An entry without a content hash may describe an earlier version of the file
+                if metadata.get("description") and metadata.get("content_hash") == content_hashes[photo_path]:
+                    descriptions[photo_path] = metadata["description"]
+                    self.embed_cache.put(content_hashes[photo_path], self.cache_model_key, aspect_name,
+                                         custom_prompt, embeddings[photo_path], descriptions[photo_path])
+            for photo_path in uncached_paths:
+                descriptions.setdefault(photo_path, "")
+        elif uncached_paths:
+            # Ollama has no multi-image describe call, so overlap the per-image requests instead
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                descriptions.update(zip(uncached_paths, executor.map(
+                    lambda p: self._generate_description_with_ollama(p, custom_prompt, description_images[p]),
+                    uncached_paths
+                )))
+            for photo_path in uncached_paths:
+                # An empty description means Ollama failed; don't cache it so the next run retries
+                if descriptions[photo_path]:
+                    self.embed_cache.put(content_hashes[photo_path], self.cache_model_key, aspect_name,
+                                         custom_prompt, embeddings[photo_path], descriptions[photo_path])
+
+        for photo_path, original in duplicates.items():
+            self.logger.debug("%s has the same contents as %s", photo_path, original)
+            if original in results:
+                results[photo_path] = results[original]
+            else:
+                embeddings[photo_path], descriptions[photo_path] = embeddings[original], descriptions[original]
+
+        valid_paths = [p for p in photo_paths if p not in results]
+        if valid_paths:
+            try:
+                self.upsert_batch([
+                    (f"{str(p)}_{aspect_name}", embeddings[p],
+                     {"photo_path": str(p), "aspect_name": aspect_name, "description": descriptions[p],
+                      "content_hash": photo_hashes[p]})
+                    for p in valid_paths
+                ])
+                for photo_path in valid_paths:
+                    results[photo_path] = (True, f"Indexed {photo_path.name} with aspect '{aspect_name}'")
+            except Exception as e:
+                self.logger.error(f"Error updating ChromaDB for batch: {str(e)}", exc_info=True)
+                for photo_path in valid_paths:
+                    results[photo_path] = (False, f"Database update error: {str(e)}")
+
+        return [results[photo_path] for photo_path in photo_paths]
+
+    def describe_photos(self, photo_paths, custom_prompt=None, aspect_name="default", max_workers=4):
+        """Generate descriptions for indexed photos stored without one, e.g. with describe=False.
+
+        Only the descriptions are updated; the stored embeddings are kept and, for entries with a
+        content_hash, cached together with the new descriptions. Returns a list of
+        (success, message) tuples for the photos that needed a description.
+        """
+        entries = self.collection.get(ids=[f"{str(p)}_{aspect_name}" for p in photo_paths],
+                                      include=["embeddings", "metadatas"])
+        missing = [(entry_id, embedding, metadata)
+                   for entry_id, embedding, metadata in zip(entries["ids"], entries["embeddings"], entries["metadatas"])
+                   if not metadata.get("description")]
+        if not missing:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            descriptions = list(executor.map(
+                lambda item: self._generate_description_with_ollama(item[2]["photo_path"], custom_prompt),
+                missing
+            ))
+
+        results = []
+        described = []
+        for (entry_id, embedding, metadata), description in zip(missing, descriptions):
+            name = Path(metadata["photo_path"]).name
+            if description:
+                described.append((entry_id, embedding, {**metadata, "description": description}))
+                results.append((True, f"Described {name} with aspect '{aspect_name}'"))
+            else:
+                results.append((False, f"Error generating description for {name}"))
+
+        if described:
+            try:
+                # Passing the stored embeddings back keeps Chroma from embedding the new documents itself
+                self.upsert_batch(described)
+            except Exception as e:
+                self.logger.error(f"Error updating descriptions in ChromaDB: {str(e)}", exc_info=True)
+                return [(False, f"Database update error: {str(e)}")] * len(missing)
+            # Cache them like add_prepared_photos does, so later runs neither re-embed nor re-describe
+            for _, embedding, metadata in described:
+                if metadata.get("content_hash"):
+                    self.embed_cache.put(metadata["content_hash"], self.cache_model_key, aspect_name,
+                                         custom_prompt, embedding, metadata["description"])
+        return results
+
+    def upsert_batch(self, items):
+        """Insert or replace (entry_id, embedding, metadata) items with a single Chroma upsert.
+
+        The metadata's description is stored as the entry's document. Items whose metadata has a
+        content_hash and matches the stored entry's exactly are skipped, so re-indexing unchanged
+        photos does not rewrite the index or invalidate the search caches.
+        """
+        hashed_ids = [entry_id for entry_id, _, metadata in items if "content_hash" in metadata]
+        if hashed_ids:
+            existing = self.collection.get(ids=hashed_ids, include=["metadatas"])
+            stored = dict(zip(existing["ids"], existing["metadatas"]))
+            items = [item for item in items if stored.get(item[0]) != item[2] or "content_hash" not in item[2]]
+        if not items:
+            return
+        self._collection_changed()
+        ids, embeddings, metadatas = zip(*items)
+        self.collection.upsert(
+            ids=list(ids),
+            embeddings=[np.asarray(embedding, dtype=np.float32).tolist() for embedding in embeddings],
+            documents=[metadata.get("description", "") for metadata in metadatas],
+            metadatas=list(metadatas)
+        )
+
+    def clear(self):
+        """Remove every entry by dropping and recreating the collection, then reclaim its disk space."""
+        self._collection_changed()
+        metadata = self.collection.metadata
+        self.chroma_client.delete_collection(self.collection.name)
+        self.collection = self.chroma_client.get_or_create_collection(
+            name="photo_collection",
+            metadata=metadata
+        )
+
+        self._reclaim_disk_space()
+
+    def rebuild_index(self, hnsw_params=None, page_size=1000):
+        """Rebuild the collection's HNSW index with hnsw_params, keeping every entry.
+
+        Chroma fixes a collection's HNSW parameters when its index is created, so the stored
+        embeddings are copied into a new collection; no images are re-processed.
+        """
+        name = self.collection.name
+        metadata = {**HNSW_DEFAULTS, **(self.collection.metadata or {}), **(hnsw_params or {})}
+        rebuild_name = f"{name}_rebuild"
+        old_name = f"{name}_old"
+        for leftover in (rebuild_name, old_name):
+            try:
+                # Left over from an interrupted rebuild; the live collection is already in place
+                self.chroma_client.delete_collection(leftover)
+            except ValueError:
+                pass
+
+        rebuilt = self.chroma_client.create_collection(name=rebuild_name, metadata=metadata)
+        for page in self._iter_pages(["embeddings", "documents", "metadatas"], page_size):
+            if page["ids"]:
+                rebuilt.upsert(ids=page["ids"], embeddings=page["embeddings"],
+                               documents=page["documents"], metadatas=page["metadatas"])
+
+        self._collection_changed()
+        # Set the live collection aside rather than dropping it first, so an interruption never
+        # leaves the entries only in the rebuild; see _restore_interrupted_rebuild
+        self.collection.modify(name=old_name)
+        rebuilt.modify(name=name)
+        self.collection = rebuilt
+        self.chroma_client.delete_collection(old_name)
+        self._reclaim_disk_space()
+
+    def _restore_interrupted_rebuild(self, name):
+        """Move the collection set aside by an interrupted rebuild_index back to `name`."""
+        names = {collection.name for collection in self.chroma_client.list_collections()}
+        if name not in names and f"{name}_old" in names:
+            self.chroma_client.get_collection(f"{name}_old").modify(name=name)
+
+    def _reclaim_disk_space(self):
+        # Chroma leaves a dropped collection's HNSW segment directory and free sqlite pages behind
+        with closing(sqlite3.connect(self.persist_directory / "chroma.sqlite3")) as conn:
+            segment_ids = {row[0] for row in conn.execute("SELECT id FROM segments")}
+            conn.execute("VACUUM")
+        for path in self.persist_directory.iterdir():
+            if path.is_dir() and _is_uuid(path.name) and path.name not in segment_ids:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _collection_changed(self):
+        self.query_cache.invalidate_results()
+        with self._quantized_lock:
+            self._quantized = None
+            for name in ("codes.npy", "scales.npy", "index.json"):
+                (self.quantized_directory / name).unlink(missing_ok=True)
+        with self._usearch_lock:
+            self._usearch = None
+            for name in ("index.usearch", "index.json"):
+                (self.usearch_directory / name).unlink(missing_ok=True)
+
+    def _load_quantized_index(self):
+        """Return (int8 codes, scales, ids, aspect names) for the whole collection.
+
+        Unit-normalized embeddings are quantized to int8 per row and persisted next to
+        the Chroma database, then memory-mapped, so exact searches scan a quarter of the
+        bytes of the float32 embeddings. Any write through the store deletes the files.
+        """
+        with self._quantized_lock:
+            if self._quantized is None:
+                self._quantized = self._read_quantized_index() or self._build_quantized_index()
+            return self._quantized
+
+    def _read_quantized_index(self):
+        try:
+            with open(self.quantized_directory / "index.json") as f:
+                index = json.load(f)
+            codes = np.load(self.quantized_directory / "codes.npy", mmap_mode="r")
+            scales = np.load(self.quantized_directory / "scales.npy")
+        except (OSError, ValueError):
+            return None
+        # Another process may have written to the collection without going through this store
+        if len(index["ids"]) != self.collection.count():
+            return None
+        return codes, scales, index["ids"], np.array(index["aspects"], dtype=object)
+
+    def _build_quantized_index(self):
+        self.logger.debug("Building quantized embedding index")
+        codes, scales, ids, aspects = [], [], [], []
+        for page in self._iter_pages(["embeddings", "metadatas"]):
+            if not page["ids"]:
+                break
+            # Embeddings are stored unit-length, but stores indexed before that may hold raw ones
+            matrix = l2_normalize(page["embeddings"])
+            page_codes, page_scales = quantize_int8(matrix)
+            codes.append(page_codes)
+            scales.append(page_scales)
+            ids.extend(page["ids"])
+            aspects.extend(metadata.get("aspect_name") for metadata in page["metadatas"])
+        if not ids:
+            return np.empty((0, 0), dtype=np.int8), np.empty(0, dtype=np.float32), [], np.array([], dtype=object)
+
+        self.quantized_directory.mkdir(parents=True, exist_ok=True)
+        np.save(self.quantized_directory / "codes.npy", np.concatenate(codes))
+        np.save(self.quantized_directory / "scales.npy", np.concatenate(scales))
+        with open(self.quantized_directory / "index.json", "w") as f:
+            json.dump({"ids": ids, "aspects": aspects}, f)
+        return self._read_quantized_index()
+
+    def _exact_search(self, embedding, aspect_name, k):
+        """Return (metadatas, cosine distances) of the top k by scanning every stored embedding.
+
+        The int8 scan picks a few times k candidates, which are then re-ranked with their
+        float32 embeddings from Chroma.
+        """
+        codes, scales, ids, aspects = self._load_quantized_index()
+        rows = np.arange(len(ids)) if aspect_name is None else np.flatnonzero(aspects == aspect_name)
+        k = min(k, len(rows))
+        if k == 0:
+            return [], []
+
+        query = l2_normalize(embedding)
+        if aspect_name is None:
+            candidates, _ = topk_cosine(codes, query, min(4 * k, len(rows)), scales)
         else:
-            raise ValueError("Either query_image or query_text must be provided")
+            candidates, _ = topk_cosine(codes[rows], query, min(4 * k, len(rows)), scales[rows])
+
+        entries = self.collection.get(ids=[ids[i] for i in rows[candidates]], include=["embeddings", "metadatas"])
+        if not entries["ids"]:
+            return [], []
+        matrix = l2_normalize(entries["embeddings"])
+        top, scores = topk_cosine(matrix, query, min(k, len(entries["ids"])))
+        return [entries["metadatas"][i] for i in top], (1.0 - scores).tolist()
+
+    def _load_usearch_index(self):
+        """Return (usearch index, ids, aspect names) for the whole collection.
+
+        The index holds half-precision copies of the stored embeddings and is saved next to
+        the Chroma database, then memory-mapped. Any write through the store deletes it.
+        """
+        with self._usearch_lock:
+            if self._usearch is None:
+                self._usearch = self._read_usearch_index() or self._build_usearch_index()
+            return self._usearch
+
+    def _read_usearch_index(self):
+        try:
+            with open(self.usearch_directory / "index.json") as f:
+                index = json.load(f)
+            ann = USearchIndex.restore(str(self.usearch_directory / "index.usearch"), view=True)
+        except (OSError, ValueError, RuntimeError):
+            return None
+        # Another process may have written to the collection without going through this store
+        if ann is None or len(index["ids"]) != self.collection.count():
+            return None
+        return ann, index["ids"], np.array(index["aspects"], dtype=object)
+
+    def _build_usearch_index(self):
+        self.logger.debug("Building usearch index")
+        metadata = {**HNSW_DEFAULTS, **(self.collection.metadata or {})}
+        ann, ids, aspects = None, [], []
+        for page in self._iter_pages(["embeddings", "metadatas"]):
+            if not page["ids"]:
+                break
+            matrix = np.array(page["embeddings"], dtype=np.float32)
+            if ann is None:
+                ann = USearchIndex(ndim=matrix.shape[1], metric="cos", dtype="f16",
+                                   connectivity=metadata["hnsw:M"],
+                                   expansion_add=metadata["hnsw:construction_ef"],
+                                   expansion_search=metadata["hnsw:search_ef"])
+            ann.add(np.arange(len(ids), len(ids) + len(matrix)), matrix)
+            ids.extend(page["ids"])
+            aspects.extend(entry.get("aspect_name") for entry in page["metadatas"])
+        if ann is None:
+            return None, [], np.array([], dtype=object)
+
+        self.usearch_directory.mkdir(parents=True, exist_ok=True)
+        ann.save(str(self.usearch_directory / "index.usearch"))
+        with open(self.usearch_directory / "index.json", "w") as f:
+            json.dump({"ids": ids, "aspects": aspects}, f)
+        return ann, ids, np.array(aspects, dtype=object)
+
+    def _usearch_search(self, embedding, aspect_name, k):
+        """Return (metadatas, cosine distances) of the top k from the usearch index.
+
+        Returns None when an aspect filter leaves fewer than k of the over-fetched
+        candidates, so the caller can fall back to Chroma's filtered query.
+        """
+        ann, ids, aspects = self._load_usearch_index()
+        if ann is None:
+            return [], []
+
+        count = min(len(ids), k if aspect_name is None else 4 * k)
+        matches = ann.search(np.asarray(embedding, dtype=np.float32), count)
+        hits = [(row, distance) for row, distance in zip(matches.keys.tolist(), matches.distances.tolist())
+                if aspect_name is None or aspects[row] == aspect_name][:k]
+        if aspect_name is not None and len(hits) < min(k, int(np.count_nonzero(aspects == aspect_name))):
+            return None
+        if not hits:
+            return [], []
+
+        entries = self.collection.get(ids=[ids[row] for row, _ in hits], include=["metadatas"])
+        metadata_by_id = dict(zip(entries["ids"], entries["metadatas"]))
+        hits = [(ids[row], distance) for row, distance in hits if ids[row] in metadata_by_id]
+        return [metadata_by_id[entry_id] for entry_id, _ in hits], [distance for _, distance in hits]
+
+    def _chroma_search(self, embedding, aspect_name, k):
+        """Return (metadatas, cosine distances) of the top k from Chroma's HNSW index."""
+        # Chroma warns and pays for a larger search when k exceeds the number of entries
+        n_results = min(k, self.collection.count())
+        if n_results == 0:
+            return [], []
 
         self.logger.debug("Querying ChromaDB")
         query_params = {
             "query_embeddings": [embedding],
-            "n_results": k,
+            "n_results": n_results,
             "include": ["metadatas", "distances"]
         }
         if aspect_name is not None:
@@ -175,35 +673,107 @@ class PhotoVectorStore:
 
         results = self.collection.query(**query_params)
 
-        self.logger.debug(f"Raw results from ChromaDB: {results}")
+        # Formatting every returned metadata costs more than a small query itself, so leave it to logging
+        self.logger.debug("Raw results from ChromaDB: %r", results)
+        return results['metadatas'][0], results['distances'][0]
 
-        formatted_results = []
-        for metadata, distance in zip(results['metadatas'][0], results['distances'][0]):
-            self.logger.debug(f"Processing result metadata: {metadata}")
-            try:
-                photo_path = Path(metadata.get("photo_path", "Unknown"))
-                aspect = metadata.get("aspect_name", "Unknown")
-                description = metadata.get("description", "No description")
-                formatted_results.append((photo_path, aspect, distance, description))
-            except Exception as e:
-                self.logger.error(f"Error processing search result: {str(e)}")
-                self.logger.error(f"Problematic metadata: {metadata}")
+    def search(self, query_image=None, query_text=None, aspect_name=None, k=5, exact=False):
+        self.logger.info(f"Searching with aspect: {aspect_name}, k: {k}")
+        if query_image:
+            self.logger.debug("Processing query image: %s", query_image)
+            cache_key = ("image", file_sha256(query_image))
+            embed = lambda: self._get_image_embedding(query_image)
+        elif query_text:
+            self.logger.debug("Processing query text: %s", query_text)
+            cache_key = ("text", query_text)
+            embed = lambda: self._get_text_embedding(query_text)
+        else:
+            raise ValueError("Either query_image or query_text must be provided")
 
-        self.logger.debug(f"Found {len(formatted_results)} results")
+        embedding = self.query_cache.get_embedding(cache_key)
+        if embedding is None:
+            embedding = embed()
+            self.query_cache.put_embedding(cache_key, embedding)
+
+        namespace = (aspect_name, k, exact)
+        cached_results = self.query_cache.lookup_results(namespace, embedding)
+        if cached_results is not None:
+            self.logger.debug("Returning cached results for a near-duplicate query")
+            return list(cached_results)
+
+        if exact:
+            self.logger.debug("Scoring all stored embeddings")
+            metadatas, distances = self._exact_search(embedding, aspect_name, k)
+        elif self.ann_backend == "usearch":
+            self.logger.debug("Querying the usearch index")
+            metadatas, distances = (self._usearch_search(embedding, aspect_name, k)
+                                    or self._chroma_search(embedding, aspect_name, k))
+        else:
+            metadatas, distances = self._chroma_search(embedding, aspect_name, k)
+
+        # Paths stay strings: callers only print them or pass them to open()
+        formatted_results = [
+            (metadata.get("photo_path", "Unknown"), metadata.get("aspect_name", "Unknown"),
+             distance, metadata.get("description", "No description"))
+            for metadata, distance in zip(metadatas, distances)
+        ]
+
+        self.logger.debug("Found %d results", len(formatted_results))
+        self.query_cache.store_results(namespace, embedding, formatted_results)
         return formatted_results
 
+    def close(self):
+        """Save the query embedding cache for the next run."""
+        try:
+            self.query_cache.save_embeddings(self.query_cache_file, self.clip_model_name)
+        except OSError as e:
+            self.logger.warning(f"Could not save the query cache: {str(e)}")
+
+    def _iter_pages(self, include, page_size=1000, where=None):
+        offset = 0
+        while True:
+            page = self.collection.get(include=include, limit=page_size, offset=offset, where=where)
+            yield page
+            if len(page["ids"]) < page_size:
+                return
+            offset += page_size
+
+    def _iter_metadatas(self, page_size=1000):
+        for page in self._iter_pages(["metadatas"], page_size):
+            yield from page["metadatas"]
+
+    def indexed_photo_paths(self, aspect_name="default", page_size=10000):
+        """Return the set of photo paths with an entry for aspect_name, reading only entry ids."""
+        suffix = f"_{aspect_name}"
+        return {entry_id[:-len(suffix)] for page in self._iter_pages([], page_size)
+                for entry_id in page["ids"] if entry_id.endswith(suffix)}
+
+    def photos_missing_descriptions(self, aspect_name="default", page_size=1000):
+        """Return the photo paths whose aspect_name entry has an empty description."""
+        where = {"$and": [{"aspect_name": aspect_name}, {"description": ""}]}
+        return [metadata["photo_path"] for page in self._iter_pages(["metadatas"], page_size, where)
+                for metadata in page["metadatas"]]
+
+    def load_metadata_index(self, page_size=1000):
+        """Return {photo_path: [metadata for each aspect]} for the whole collection."""
+        index = defaultdict(list)
+        for metadata in self._iter_metadatas(page_size):
+            index[metadata["photo_path"]].append(metadata)
+        return dict(index)
+
     def delete_photo(self, photo_path, aspect_name=None):
         photo_path = str(photo_path)
+        self._collection_changed()
         try:
             if aspect_name:
                 entry_id = f"{photo_path}_{aspect_name}"
                 self.collection.delete(ids=[entry_id])
                 return True, f"Deleted aspect '{aspect_name}' for photo '{photo_path}'."
             else:
-                # Delete all aspects for this photo
+                # Delete all aspects for this photo; ids are always returned, so include nothing else
                 entries = self.collection.get(
                     where={"photo_path": photo_path},
-                    include=["ids"]
+                    include=[]
                 )
                 if entries['ids']:
                     self.collection.delete(ids=entries['ids'])
@@ -216,10 +786,17 @@ class PhotoVectorStore:
 
     @classmethod
     def list_available_models(cls):
-        from ollama import models
         try:
-            model_list = models()
+            model_list = Client().list()['models']
             return [model['name'] for model in model_list]
         except Exception as e:
             logging.getLogger(__name__).error(f"Error listing models: {str(e)}", exc_info=True)
             return []
+
+
+def _is_uuid(name):
+    try:
+        uuid.UUID(name)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,79 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Kept free of torch/chromadb so worker processes only need Pillow and NumPy
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+DESCRIPTION_MAX_SIDE = 1024
+
+
+def clip_input_array(img, n_px):
+    """Apply CLIP's bicubic resize and center crop and return a CHW uint8 array.
+
+    Normalizing with CLIP_MEAN and CLIP_STD is left to the embedding device, so the batch is
+    copied to it as bytes rather than float32.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    width, height = img.size
+    if width <= height:
+        size = (n_px, int(n_px * height / width))
+    else:
+        size = (int(n_px * width / height), n_px)
+    img = img.resize(size, Image.Resampling.BICUBIC)
+
+    left = int(round((size[0] - n_px) / 2.0))
+    top = int(round((size[1] - n_px) / 2.0))
+    img = img.crop((left, top, left + n_px, top + n_px))
+
+    return np.ascontiguousarray(np.asarray(img, dtype=np.uint8).transpose(2, 0, 1))
+
+
+def encode_for_description(img, max_side=DESCRIPTION_MAX_SIDE):
+    """Return the image as RGB JPEG bytes, downscaled to at most max_side, for the description model."""
+    # For a JPEG that has not been loaded yet, libjpeg decodes straight to RGB at 1/2, 1/4 or 1/8
+    # scale, often leaving nothing for convert or thumbnail to do; otherwise a no-op
+    img.draft('RGB', (max_side, max_side))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if max(img.size) > max_side:
+        # The description model does not need LANCZOS/BICUBIC quality for a downscale
+        img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=85, optimize=False)
+    return buffered.getvalue()
+
+
+def original_jpeg_bytes(photo_path, img, max_side=DESCRIPTION_MAX_SIDE):
+    """Return the file's own bytes if it is an RGB JPEG no larger than max_side, else None.
+
+    Checks the size the image was opened with, so call it before img.draft() shrinks it.
+    """
+    if img.format == 'JPEG' and img.mode == 'RGB' and max(img.size) <= max_side:
+        with open(photo_path, 'rb') as f:
+            return f.read()
+    return None
+
+
+def description_image_bytes(photo_path, img, max_side=DESCRIPTION_MAX_SIDE):
+    """Like encode_for_description, but an RGB JPEG that is already small enough is sent as the file's own bytes."""
+    return original_jpeg_bytes(photo_path, img, max_side) or encode_for_description(img, max_side)
+
+
+def preprocess_photo(photo_path, n_px, describe=True):
+    """Decode a photo once and return (CLIP input array, description image bytes or None if not describe).
+
+    A plain module-level function so it can run in a ProcessPoolExecutor worker.
+    """
+    with Image.open(photo_path) as img:
+        # Decide on sending the file as is before draft() replaces the size it reports
+        description_image = original_jpeg_bytes(photo_path, img) if describe else None
+        # Let libjpeg decode large JPEGs at 1/2, 1/4 or 1/8 scale, never below the description size,
+        # which also keeps the short side well above CLIP's input resolution
+        img.draft('RGB', (DESCRIPTION_MAX_SIDE, DESCRIPTION_MAX_SIDE))
+        img.load()
+        if describe and description_image is None:
+            description_image = encode_for_description(img)
+        return clip_input_array(img, n_px), description_image
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class QueryCache:
+    """In-memory cache of query embeddings and recent search results.
+
+    Embeddings are cached exactly by (kind, key) tuples, e.g. ("text", query text) or
+    ("image", file hash), and can be saved to and loaded from disk. Results are
+    cached semantically: a query whose embedding has cosine similarity of at
+    least `threshold` with a recent query in the same namespace, and which is
+    younger than `ttl` seconds, reuses that query's results.
+    """
+
+    def __init__(self, threshold=0.97, ttl=300.0, max_embeddings=512, max_results=256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._embeddings = OrderedDict()
+        self._max_embeddings = max_embeddings
+        self._results = deque(maxlen=max_results)
+        self._lock = threading.Lock()
+
+    def get_embedding(self, key):
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is not None:
+                self._embeddings.move_to_end(key)
+            return embedding
+
+    def put_embedding(self, key, embedding):
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self._max_embeddings:
+                self._embeddings.popitem(last=False)
+
+    def save_embeddings(self, path, tag=""):
+        """Write the cached embeddings to an .npz file; `tag` names the model that produced them."""
+        with self._lock:
+            items = list(self._embeddings.items())
+        if not items:
+            return
+        # A unique temporary file, so concurrent saves never write into each other's file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    tag=np.array(tag),
+                    kinds=np.array([kind for (kind, _), _ in items]),
+                    keys=np.array([key for (_, key), _ in items]),
+                    embeddings=np.array([embedding for _, embedding in items], dtype=np.float32)
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load_embeddings(self, path, tag=""):
+        """Add embeddings saved by save_embeddings with the same `tag`; a missing, stale or corrupt file is ignored."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["tag"]) != tag:
+                    return
+                items = list(zip(data["kinds"].tolist(), data["keys"].tolist(), data["embeddings"].tolist()))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return
+        for kind, key, embedding in items:
+            self.put_embedding((kind, key), embedding)
+
+    def lookup_results(self, namespace, embedding):
+        """Return cached results for a near-duplicate query, or None."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [entry for entry in self._results
+                          if entry[0] == namespace and now - entry[3] <= self.ttl]
+        if not candidates:
+            return None
+
+        scores = np.stack([entry[1] for entry in candidates]) @ _unit(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return candidates[best][2]
+        return None
+
+    def store_results(self, namespace, embedding, results):
+        with self._lock:
+            self._results.append((namespace, _unit(embedding), list(results), time.monotonic()))
+
+    def invalidate_results(self):
+        """Forget cached results, e.g. after the collection has changed."""
+        with self._lock:
+            self._results.clear()
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) + 1e-12)
@@ -1,6 +1,9 @@
 import subprocess
 import platform
 import os
+from itertools import islice
+
+IMAGE_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg'})
 
 def open_image(image_path):
     """Open an image file with the default image viewer."""
@@ -10,3 +13,25 @@ def open_image(image_path):
         subprocess.run(["open", image_path])
     else:  # Linux and other Unix
         subprocess.run(["xdg-open", image_path])
+
+def chunked(iterable, size):
+    """Yield successive lists of at most `size` items from an iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def iter_image_files(root, extensions=IMAGE_EXTENSIONS):
+    """Recursively yield paths of image files under root, without stat-ing non-images."""
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # An unreadable directory should not end the whole walk
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1][1:].lower() in extensions:
+                    yield entry.path
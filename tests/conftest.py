@@ -0,0 +1,56 @@
+import clip
+import numpy as np
+import pytest
+import torch
+from clip.model import CLIP
+from PIL import Image
+
+import photo_vector_search.photo_vector_search as photo_vector_search
+
+INPUT_RESOLUTION = 64
+
+
+def tiny_clip_load(name, device="cpu", **kwargs):
+    """Stand-in for clip.load: a small randomly initialized CLIP with the real preprocessing."""
+    torch.manual_seed(0)
+    model = CLIP(embed_dim=32, image_resolution=INPUT_RESOLUTION, vision_layers=1, vision_width=64,
+                 vision_patch_size=16, context_length=77, vocab_size=49408, transformer_width=64,
+                 transformer_heads=1, transformer_layers=1)
+    return model.to(device).eval(), clip.clip._transform(INPUT_RESOLUTION)
+
+
+class FakeOllamaClient:
+    """Stand-in for ollama.Client that describes an image by its size and records each prompt."""
+
+    def __init__(self, *args, **kwargs):
+        self.prompts = []
+
+    def generate(self, **kwargs):
+        if kwargs.get("prompt") is None:
+            return {"response": ""}
+        self.prompts.append(kwargs["prompt"])
+        return {"response": f" a photo of {len(kwargs['images'][0])} bytes "}
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    """Return a factory for PhotoVectorStores in tmp_path/db, using tiny_clip_load and FakeOllamaClient."""
+    monkeypatch.setattr(clip, "load", tiny_clip_load)
+    monkeypatch.setattr(photo_vector_search, "Client", FakeOllamaClient)
+
+    def make(**kwargs):
+        return photo_vector_search.PhotoVectorStore(persist_directory=str(tmp_path / "db"), **kwargs)
+    return make
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+
+def write_photo(path, seed, size=(160, 120), format=None):
+    """Write an image of random noise and return its path."""
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(pixels).save(path, format=format)
+    return path
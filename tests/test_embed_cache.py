@@ -0,0 +1,76 @@
+import pytest
+
+from photo_vector_search.embed_cache import EmbeddingCache, file_sha256
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put("abc", "model", "default", None, [0.5, -1.0, 2.0], "a cat")
+
+    embedding, description = cache.get("abc", "model", "default")
+    assert embedding == pytest.approx([0.5, -1.0, 2.0])
+    assert description == "a cat"
+
+
+def test_persists_across_instances(tmp_path):
+    EmbeddingCache(tmp_path / "cache.sqlite").put("abc", "model", "default", "prompt", [1.0], "a dog")
+    assert EmbeddingCache(tmp_path / "cache.sqlite").get("abc", "model", "default", "prompt") == ([1.0], "a dog")
+
+
+def test_key_includes_model_aspect_and_prompt(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put("abc", "model", "default", None, [1.0], "a cat")
+
+    assert cache.get("abc", "other model", "default") is None
+    assert cache.get("abc", "model", "safety") is None
+    assert cache.get("abc", "model", "default", "custom prompt") is None
+    assert cache.get("def", "model", "default") is None
+
+
+def test_ttl_expires_entries(tmp_path, monkeypatch):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", ttl=10)
+    cache.put("abc", "model", "default", None, [1.0], "a cat")
+
+    import photo_vector_search.embed_cache as embed_cache
+    now = embed_cache.time.time()
+    monkeypatch.setattr(embed_cache.time, "time", lambda: now + 60)
+    assert cache.get("abc", "model", "default") is None
+
+
+def test_hits_refresh_last_use_at_most_once_per_interval(tmp_path, monkeypatch):
+    import photo_vector_search.embed_cache as embed_cache
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put("abc", "model", "default", None, [1.0], "a cat")
+    mtime = lambda: cache._connection().execute("SELECT mtime FROM cache").fetchone()[0]
+    stored = mtime()
+
+    now = embed_cache.time.time()
+    monkeypatch.setattr(embed_cache.time, "time", lambda: now + 60)
+    assert cache.get("abc", "model", "default") is not None
+    assert mtime() == stored
+
+    monkeypatch.setattr(embed_cache.time, "time", lambda: now + cache.touch_interval + 60)
+    assert cache.get("abc", "model", "default") is not None
+    assert mtime() == now + cache.touch_interval + 60
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_entries=10)
+    for i in range(256):
+        cache.put(f"hash{i}", "model", "default", None, [float(i)], str(i))
+
+    # Eviction runs every 256 puts and keeps the newest max_entries
+    assert cache.get("hash0", "model", "default") is None
+    assert cache.get("hash255", "model", "default") == ([255.0], "255")
+    count = cache._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    assert count == 10
+
+
+def test_file_sha256_depends_only_on_contents(tmp_path):
+    first = tmp_path / "a.jpg"
+    second = tmp_path / "b.jpg"
+    first.write_bytes(b"same bytes")
+    second.write_bytes(b"same bytes")
+
+    assert file_sha256(first) == file_sha256(second)
+    second.write_bytes(b"other bytes")
+    assert file_sha256(first) != file_sha256(second)
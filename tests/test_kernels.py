@@ -0,0 +1,59 @@
+import numpy as np
+
+from photo_vector_search._kernels import dot_scores, l2_normalize, quantize_int8, topk_cosine
+
+
+def _unit_rows(matrix):
+    return (matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def test_l2_normalize_rows_and_vectors():
+    matrix = l2_normalize([[3.0, 4.0], [0.0, 2.0]])
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, rtol=1e-6)
+    np.testing.assert_allclose(l2_normalize([3.0, 4.0]), [0.6, 0.8], rtol=1e-6)
+
+
+def test_quantize_int8_round_trip():
+    rng = np.random.default_rng(0)
+    matrix = _unit_rows(rng.standard_normal((50, 64)))
+    codes, scales = quantize_int8(matrix)
+
+    assert codes.dtype == np.int8
+    np.testing.assert_allclose(codes * scales[:, None], matrix, atol=scales.max())
+
+
+def test_quantize_int8_handles_zero_rows():
+    codes, scales = quantize_int8(np.zeros((2, 4), dtype=np.float32))
+    assert not codes.any()
+    assert np.all(scales == 1.0)
+
+
+def test_dot_scores_matches_numpy():
+    rng = np.random.default_rng(1)
+    matrix = rng.standard_normal((20, 8)).astype(np.float32)
+    query = rng.standard_normal(8).astype(np.float32)
+    np.testing.assert_allclose(dot_scores(matrix, query), matrix @ query, rtol=1e-5)
+
+    codes, _ = quantize_int8(matrix)
+    np.testing.assert_allclose(dot_scores(codes, query), codes.astype(np.float32) @ query, rtol=1e-5)
+
+
+def test_topk_cosine_sorted_by_score():
+    rng = np.random.default_rng(2)
+    matrix = _unit_rows(rng.standard_normal((100, 16)))
+    query = matrix[42]
+
+    top, scores = topk_cosine(matrix, query, 5)
+    assert top[0] == 42
+    assert np.all(np.diff(scores) <= 0)
+    np.testing.assert_array_equal(top, np.argsort(-(matrix @ query))[:5])
+
+
+def test_topk_cosine_with_int8_codes():
+    rng = np.random.default_rng(3)
+    matrix = _unit_rows(rng.standard_normal((100, 32)))
+    codes, scales = quantize_int8(matrix)
+
+    top, _ = topk_cosine(codes, matrix[7], 3, scales)
+    assert top[0] == 7
@@ -0,0 +1,192 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from photo_vector_search.embed_cache import EmbeddingCache, file_sha256
+
+from .conftest import write_photo
+
+
+def index_without_descriptions(store, photo_paths, aspect_name="default"):
+    prepared = [store.prepare_photo(p, aspect_name=aspect_name, describe=False) for p in photo_paths]
+    return store.add_prepared_photos(prepared, aspect_name=aspect_name, describe=False)
+
+
+def stored_metadata(store, photo_path, aspect_name="default"):
+    return store.collection.get(ids=[f"{photo_path}_{aspect_name}"])["metadatas"][0]
+
+
+def test_batch_add_stores_each_photo(store, tmp_path):
+    photos = [write_photo(tmp_path / f"img{i}.jpg", i) for i in range(3)]
+    results = store.add_or_update_photos_batch(photos + [tmp_path / "missing.jpg"])
+
+    assert [success for success, _ in results] == [True, True, True, False]
+    assert store.collection.count() == 3
+    assert stored_metadata(store, photos[0]) == {
+        "photo_path": str(photos[0]), "aspect_name": "default",
+        "description": f"a photo of {photos[0].stat().st_size} bytes", "content_hash": file_sha256(photos[0])
+    }
+
+
+def test_duplicate_photos_in_a_batch_are_processed_once(store, tmp_path):
+    original = write_photo(tmp_path / "a.jpg", 0)
+    copy = shutil.copy(original, tmp_path / "b.jpg")
+    store.add_or_update_photos_batch([original, copy])
+
+    assert len(store.ollama_client.prompts) == 1
+    entries = store.collection.get(include=["embeddings", "metadatas"])
+    assert sorted(metadata["photo_path"] for metadata in entries["metadatas"]) == [str(original), str(copy)]
+    np.testing.assert_array_equal(entries["embeddings"][0], entries["embeddings"][1])
+    assert entries["metadatas"][0]["description"] == entries["metadatas"][1]["description"]
+
+
+def test_upsert_batch_skips_unchanged_entries(store, monkeypatch):
+    changes = []
+    monkeypatch.setattr(store, "_collection_changed", lambda: changes.append(True))
+    metadata = {"photo_path": "a.jpg", "aspect_name": "default", "description": "a cat", "content_hash": "abc"}
+    store.upsert_batch([("a.jpg_default", [1.0, 0.0], metadata)])
+    assert len(changes) == 1
+
+    store.upsert_batch([("a.jpg_default", [1.0, 0.0], dict(metadata))])
+    assert len(changes) == 1
+
+    store.upsert_batch([("a.jpg_default", [1.0, 0.0], {**metadata, "description": "a dog"})])
+    assert len(changes) == 2
+    assert store.collection.get(ids=["a.jpg_default"])["documents"] == ["a dog"]
+
+    # Without a content hash there is nothing to compare, so the entry is always written
+    unhashed = {"photo_path": "b.jpg", "aspect_name": "default", "description": "a bird"}
+    store.upsert_batch([("b.jpg_default", [0.0, 1.0], unhashed)])
+    store.upsert_batch([("b.jpg_default", [0.0, 1.0], dict(unhashed))])
+    assert len(changes) == 4
+
+
+def test_reindexing_unchanged_photos_keeps_cached_results(store, tmp_path):
+    photos = [write_photo(tmp_path / f"img{i}.jpg", i) for i in range(3)]
+    store.add_or_update_photos_batch(photos)
+    results = store.search(query_text="a cat", k=2)
+
+    store.add_or_update_photos_batch(photos)
+    query = store.query_cache.get_embedding(("text", "a cat"))
+    assert store.query_cache.lookup_results((None, 2, False), query) == results
+
+
+def test_delete_photo_removes_every_aspect(store, tmp_path):
+    photo = write_photo(tmp_path / "a.jpg", 0)
+    other = write_photo(tmp_path / "b.jpg", 1)
+    store.add_or_update_photos_batch([photo, other])
+    store.add_or_update_photos_batch([photo], custom_prompt="Is it safe?", aspect_name="safety")
+
+    assert store.delete_photo(photo)[0]
+    assert list(store.load_metadata_index()) == [str(other)]
+    assert not store.delete_photo(photo)[0]
+
+
+def test_delete_photo_removes_one_aspect(store, tmp_path):
+    photo = write_photo(tmp_path / "a.jpg", 0)
+    store.add_or_update_photos_batch([photo])
+    store.add_or_update_photos_batch([photo], custom_prompt="Is it safe?", aspect_name="safety")
+
+    assert store.delete_photo(photo, "safety")[0]
+    assert [metadata["aspect_name"] for metadata in store.load_metadata_index()[str(photo)]] == ["default"]
+
+
+def test_indexing_without_descriptions_skips_ollama(store, tmp_path):
+    photos = [write_photo(tmp_path / f"img{i}.jpg", i) for i in range(2)]
+    results = index_without_descriptions(store, photos)
+
+    assert all(success for success, _ in results)
+    assert store.ollama_client.prompts == []
+    assert sorted(store.photos_missing_descriptions()) == sorted(str(p) for p in photos)
+    # Not cached, so a later run with descriptions still describes them
+    assert store.embed_cache.get(file_sha256(photos[0]), store.cache_model_key, "default") is None
+
+
+def test_indexing_without_descriptions_keeps_descriptions_of_unchanged_photos(store, tmp_path):
+    photo = write_photo(tmp_path / "a.jpg", 0)
+    store.add_or_update_photos_batch([photo])
+    description = stored_metadata(store, photo)["description"]
+
+    store.embed_cache = EmbeddingCache(tmp_path / "other_cache.sqlite")
+    index_without_descriptions(store, [photo])
+    assert stored_metadata(store, photo)["description"] == description
+    assert store.embed_cache.get(file_sha256(photo), store.cache_model_key, "default")[1] == description
+
+
+def test_indexing_without_descriptions_blanks_descriptions_of_edited_photos(store, tmp_path):
+    photo = write_photo(tmp_path / "a.jpg", 0)
+    store.add_or_update_photos_batch([photo])
+    # An entry indexed before content hashes were stored
+    entry = store.collection.get(ids=[f"{photo}_default"], include=["embeddings", "metadatas"])
+    legacy = {key: value for key, value in entry["metadatas"][0].items() if key != "content_hash"}
+    store.collection.delete(ids=entry["ids"])
+    store.collection.add(ids=entry["ids"], embeddings=entry["embeddings"], metadatas=[legacy])
+
+    write_photo(photo, 1)
+    index_without_descriptions(store, [photo])
+    assert stored_metadata(store, photo)["description"] == ""
+    assert store.embed_cache.get(file_sha256(photo), store.cache_model_key, "default") is None
+
+
+def test_describe_photos_fills_in_and_caches_descriptions(store, tmp_path):
+    photos = [write_photo(tmp_path / f"img{i}.jpg", i) for i in range(2)]
+    index_without_descriptions(store, photos)
+    embeddings = store.collection.get(ids=[f"{photos[0]}_default"], include=["embeddings"])["embeddings"][0]
+
+    results = store.describe_photos(photos)
+    assert all(success for success, _ in results)
+    assert store.photos_missing_descriptions() == []
+    entry = store.collection.get(ids=[f"{photos[0]}_default"], include=["embeddings", "metadatas", "documents"])
+    np.testing.assert_array_equal(entry["embeddings"][0], embeddings)
+    assert entry["documents"][0] == entry["metadatas"][0]["description"] != ""
+
+    cached_embedding, cached_description = store.embed_cache.get(
+        file_sha256(photos[0]), store.cache_model_key, "default")
+    assert cached_description == entry["metadatas"][0]["description"]
+    np.testing.assert_allclose(cached_embedding, embeddings, rtol=1e-6)
+    assert store.describe_photos(photos) == []
+
+
+def test_single_and_batch_embeddings_match(store, tmp_path):
+    # Large enough for JPEG draft decoding to apply
+    photo = write_photo(tmp_path / "large.jpg", 0, size=(4000, 3000))
+    single = store._get_image_embedding(photo)
+    batch = store._get_image_embeddings([store.prepare_photo(photo, describe=False).image])[0]
+    np.testing.assert_allclose(single, batch, rtol=1e-6)
+
+
+def indexed_store(make_store, tmp_path, **kwargs):
+    store = make_store(**kwargs)
+    photos = [write_photo(tmp_path / f"img{i}.jpg", i) for i in range(12)]
+    store.add_or_update_photos_batch(photos)
+    store.add_or_update_photos_batch(photos[:4], custom_prompt="Is it safe?", aspect_name="safety")
+    return store, photos
+
+
+def photo_paths(metadatas):
+    # A photo's aspects share its embedding, so their relative order is arbitrary
+    return [metadata["photo_path"] for metadata in metadatas]
+
+
+@pytest.mark.parametrize("aspect_name", [None, "safety"])
+def test_exact_search_matches_chroma(make_store, tmp_path, aspect_name):
+    store, photos = indexed_store(make_store, tmp_path)
+    query = store._get_image_embedding(photos[2])
+
+    exact_metadatas, exact_distances = store._exact_search(query, aspect_name, 3)
+    chroma_metadatas, chroma_distances = store._chroma_search(query, aspect_name, 3)
+    assert photo_paths(exact_metadatas) == photo_paths(chroma_metadatas)
+    np.testing.assert_allclose(exact_distances, chroma_distances, atol=1e-5)
+
+
+@pytest.mark.parametrize("aspect_name", [None, "safety"])
+def test_usearch_search_matches_chroma(make_store, tmp_path, aspect_name):
+    pytest.importorskip("usearch")
+    store, photos = indexed_store(make_store, tmp_path, ann_backend="usearch")
+    query = store._get_image_embedding(photos[2])
+
+    usearch_metadatas, usearch_distances = store._usearch_search(query, aspect_name, 3)
+    chroma_metadatas, chroma_distances = store._chroma_search(query, aspect_name, 3)
+    assert photo_paths(usearch_metadatas) == photo_paths(chroma_metadatas)
+    np.testing.assert_allclose(usearch_distances, chroma_distances, atol=1e-5)
@@ -0,0 +1,40 @@
+from io import BytesIO
+
+import clip
+import numpy as np
+from PIL import Image
+
+from photo_vector_search.preprocess import (CLIP_MEAN, CLIP_STD, DESCRIPTION_MAX_SIDE, clip_input_array,
+                                            description_image_bytes, preprocess_photo)
+
+from .conftest import write_photo
+
+
+def test_clip_input_array_matches_clip_preprocess(tmp_path):
+    for size in [(160, 120), (90, 200)]:
+        with Image.open(write_photo(tmp_path / "photo.png", 0, size=size)) as img:
+            expected = clip.clip._transform(64)(img).numpy()
+            array = clip_input_array(img, 64)
+
+        assert array.dtype == np.uint8 and array.shape == (3, 64, 64)
+        normalized = (array / 255.0 - CLIP_MEAN[:, None, None]) / CLIP_STD[:, None, None]
+        np.testing.assert_allclose(normalized, expected, atol=1e-5)
+
+
+def test_small_jpegs_are_described_from_their_own_bytes(tmp_path):
+    photo = write_photo(tmp_path / "small.jpg", 0)
+    _, description_image = preprocess_photo(photo, 64)
+    assert description_image == photo.read_bytes()
+
+
+def test_large_photos_are_downscaled_for_descriptions(tmp_path):
+    for photo in [write_photo(tmp_path / "large.jpg", 0, size=(4096, 3072)),
+                  write_photo(tmp_path / "large.png", 0, size=(2000, 1000))]:
+        clip_input, description_image = preprocess_photo(photo, 64)
+        assert clip_input.shape == (3, 64, 64)
+        with Image.open(photo) as img:
+            assert description_image == description_image_bytes(photo, img)
+        with Image.open(BytesIO(description_image)) as img:
+            assert img.format == "JPEG" and max(img.size) <= DESCRIPTION_MAX_SIDE
+
+    assert preprocess_photo(photo, 64, describe=False)[1] is None
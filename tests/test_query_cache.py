@@ -0,0 +1,76 @@
+import numpy as np
+
+from photo_vector_search.query_cache import QueryCache
+
+
+def test_embedding_lru_eviction():
+    cache = QueryCache(max_embeddings=2)
+    cache.put_embedding(("text", "a"), [1.0, 0.0])
+    cache.put_embedding(("text", "b"), [0.0, 1.0])
+    cache.get_embedding(("text", "a"))
+    cache.put_embedding(("text", "c"), [1.0, 1.0])
+
+    assert cache.get_embedding(("text", "a")) == [1.0, 0.0]
+    assert cache.get_embedding(("text", "b")) is None
+    assert cache.get_embedding(("text", "c")) == [1.0, 1.0]
+
+
+def test_save_load_round_trip(tmp_path):
+    path = tmp_path / "query_cache.npz"
+    cache = QueryCache()
+    cache.put_embedding(("text", "a cat"), [1.0, 2.0])
+    cache.put_embedding(("image", "abc123"), [3.0, 4.0])
+    cache.save_embeddings(path, "ViT-B/32")
+
+    loaded = QueryCache()
+    loaded.load_embeddings(path, "ViT-B/32")
+    assert loaded.get_embedding(("text", "a cat")) == [1.0, 2.0]
+    assert loaded.get_embedding(("image", "abc123")) == [3.0, 4.0]
+
+
+def test_load_ignores_other_tag_and_missing_file(tmp_path):
+    path = tmp_path / "query_cache.npz"
+    cache = QueryCache()
+    cache.put_embedding(("text", "a cat"), [1.0, 2.0])
+    cache.save_embeddings(path, "ViT-B/32")
+
+    loaded = QueryCache()
+    loaded.load_embeddings(path, "ViT-L/14")
+    loaded.load_embeddings(tmp_path / "missing.npz", "ViT-B/32")
+    assert loaded.get_embedding(("text", "a cat")) is None
+
+
+def test_load_ignores_corrupt_file(tmp_path):
+    path = tmp_path / "query_cache.npz"
+    cache = QueryCache()
+    cache.put_embedding(("text", "a cat"), [1.0, 2.0])
+    cache.save_embeddings(path, "ViT-B/32")
+    path.write_bytes(path.read_bytes()[:-40])
+
+    loaded = QueryCache()
+    loaded.load_embeddings(path, "ViT-B/32")
+    assert loaded.get_embedding(("text", "a cat")) is None
+    assert [p.name for p in tmp_path.iterdir()] == ["query_cache.npz"]
+
+
+def test_results_reused_for_near_duplicate_queries():
+    cache = QueryCache(threshold=0.97, ttl=300)
+    cache.store_results(("default", 5), [1.0, 0.0], [("a.jpg", "default", 0.1, "a cat")])
+
+    assert cache.lookup_results(("default", 5), [1.0, 0.01]) == [("a.jpg", "default", 0.1, "a cat")]
+    assert cache.lookup_results(("default", 5), [0.0, 1.0]) is None
+    assert cache.lookup_results(("other", 5), [1.0, 0.0]) is None
+
+
+def test_results_expire_and_invalidate(monkeypatch):
+    import photo_vector_search.query_cache as query_cache
+    cache = QueryCache(ttl=300)
+    cache.store_results("ns", np.array([1.0, 0.0]), ["result"])
+    now = query_cache.time.monotonic()
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now + 301)
+    assert cache.lookup_results("ns", [1.0, 0.0]) is None
+
+    cache = QueryCache()
+    cache.store_results("ns", [1.0, 0.0], ["result"])
+    cache.invalidate_results()
+    assert cache.lookup_results("ns", [1.0, 0.0]) is None
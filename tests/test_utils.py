@@ -0,0 +1,35 @@
+import os
+
+from photo_vector_search import utils
+from photo_vector_search.utils import chunked, iter_image_files
+
+
+def test_chunked():
+    assert list(chunked(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunked(iter(range(3)), 3)) == [[0, 1, 2]]
+    assert list(chunked([], 3)) == []
+
+
+def test_iter_image_files_walks_subdirectories(tmp_path):
+    for name in ["a.jpg", "b.PNG", "sub/c.JPEG", "sub/deeper/d.jpeg", "notes.txt", "jpg", "sub/e.gif"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+
+    found = sorted(os.path.relpath(path, tmp_path) for path in iter_image_files(tmp_path))
+    assert found == ["a.jpg", "b.PNG", os.path.join("sub", "c.JPEG"), os.path.join("sub", "deeper", "d.jpeg")]
+
+
+def test_iter_image_files_skips_unreadable_directories(tmp_path, monkeypatch):
+    for name in ["a.jpg", "locked/b.jpg", "open/c.jpg"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+
+    scandir = os.scandir
+    def failing_scandir(path):
+        if os.path.basename(path) == "locked":
+            raise PermissionError(path)
+        return scandir(path)
+    monkeypatch.setattr(utils.os, "scandir", failing_scandir)
+
+    found = sorted(os.path.relpath(path, tmp_path) for path in iter_image_files(tmp_path))
+    assert found == ["a.jpg", os.path.join("open", "c.jpg")]